@@ -0,0 +1,8 @@
+"""
+BioUnfold — reusable code behind the analysis notebooks.
+
+Modules are import-safe: nothing is simulated, fitted, plotted or written
+to disk at import time.
+"""
+
+__version__ = "0.1.0"
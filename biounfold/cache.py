@@ -0,0 +1,196 @@
+"""
+Content-addressed disk cache for correction and PCA results.
+
+    cache = ResultCache("~/.cache/biounfold", max_bytes=20 * 2**30)
+    X_align = cache(batch_align_minimal, X, batch, design=design)
+    coords, var = cache(pca2d, X_align)
+
+The key is a blake2b hash of the function's qualified name, its bytecode and
+the biounfold version, and of every argument's content — array bytes (hashed
+block by block, so memmaps are not loaded whole), labels and their index,
+the design, and scalar parameters. Unchanged inputs therefore hit the cache,
+and any change to them misses; so does an edit to the function itself or a
+new release. Edits to helpers it calls are not seen: bump the version (or
+clear the cache) when changing them.
+
+Each entry is a `.npy` file (reopened memory-mapped, read-only) plus a small
+pickle with what is needed to rebuild the result: the index/columns of a
+DataFrame or Embedding, or the scalar fields of a PCAResult. Hits refresh the entry's
+mtime; after every store the least recently used entries are deleted until
+the cache fits in `max_bytes`.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+from dataclasses import fields
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from . import __version__
+from .metrics import Embedding, PCAResult
+
+
+def _update(h, obj):
+    """Feed the content of an argument into hash `h` (type-tagged)."""
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, np.dtype) or (isinstance(obj, type) and issubclass(obj, np.generic)):
+        h.update(f"dtype:{np.dtype(obj).str};".encode())
+    elif isinstance(obj, pd.DataFrame):
+        h.update(b"frame;")
+        _update(h, obj.index)
+        _update(h, obj.columns)
+        _update(h, obj.to_numpy())
+    elif isinstance(obj, Embedding):
+        h.update(b"embedding;")
+        _update(h, obj.index)
+        _update(h, obj.columns)
+        _update(h, obj.scores)
+    elif isinstance(obj, pd.Series):
+        h.update(b"series;")
+        _update(h, obj.index)
+        _update(h, obj.to_numpy())
+    elif isinstance(obj, pd.Index):
+        h.update(b"index;")
+        _update(h, obj.to_numpy())
+    elif sp.issparse(obj):
+        obj = obj.tocsr()
+        h.update(f"sparse:{obj.shape};".encode())
+        for part in (obj.data, obj.indices, obj.indptr):
+            _update(h, part)
+    elif isinstance(obj, np.ndarray):
+        h.update(f"array:{obj.shape}:{obj.dtype.str};".encode())
+        if obj.dtype.hasobject:
+            h.update(pd.util.hash_array(obj.ravel()).tobytes())
+            return
+        rows = obj.reshape(obj.shape[0], -1) if obj.ndim > 1 else obj.reshape(1, -1)
+        step = max(1, (1 << 24) // max(rows[:1].nbytes, 1))   # ~16 MB per update
+        for s in range(0, rows.shape[0], step):
+            h.update(np.ascontiguousarray(rows[s:s + step]).data)
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"{type(obj).__name__}:{len(obj)};".encode())
+        for item in obj:
+            _update(h, item)
+    elif isinstance(obj, dict):
+        h.update(f"dict:{len(obj)};".encode())
+        for key in sorted(obj, key=repr):
+            _update(h, key)
+            _update(h, obj[key])
+    else:
+        raise TypeError(f"cannot hash argument of type {type(obj).__name__} for the cache")
+
+
+def content_key(fn, *args, **kwargs) -> str:
+    """Hex key of a call: function name, code and version plus the content of all arguments."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{fn.__module__}.{fn.__qualname__};biounfold:{__version__};".encode())
+    code = getattr(fn, "__code__", None)
+    if code is not None:
+        h.update(code.co_code)
+    _update(h, list(args))
+    _update(h, kwargs)
+    return h.hexdigest()
+
+
+def _split(result):
+    """Result → (array stored as .npy, metadata to rebuild it)."""
+    if isinstance(result, pd.DataFrame):
+        return result.to_numpy(), {"type": "frame", "index": result.index, "columns": result.columns}
+    if isinstance(result, Embedding):
+        return result.scores, {"type": "embedding", "index": result.index, "columns": result.columns}
+    if isinstance(result, PCAResult):
+        meta = {f.name: getattr(result, f.name) for f in fields(result) if f.name != "coords"}
+        return result.coords, {"type": "pca", **meta}
+    if isinstance(result, np.ndarray):
+        return result, {"type": "array"}
+    raise TypeError(f"cannot cache results of type {type(result).__name__}")
+
+
+def _join(arr: np.ndarray, meta: dict):
+    kind = meta.pop("type")
+    if kind == "frame":
+        return pd.DataFrame(arr, index=meta["index"], columns=meta["columns"], copy=False)
+    if kind == "embedding":
+        return Embedding(scores=arr, **meta)
+    if kind == "pca":
+        return PCAResult(coords=arr, **meta)
+    return arr
+
+
+class ResultCache:
+    """
+    Disk cache of function results, keyed by argument content (see module notes).
+
+    directory : cache directory (created if missing)
+    max_bytes : size budget; least recently used entries are evicted beyond it
+    """
+
+    def __init__(self, directory, max_bytes: int = 10 * 2**30):
+        self.directory = Path(directory).expanduser()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _paths(self, key: str):
+        return self.directory / f"{key}.npy", self.directory / f"{key}.meta.pkl"
+
+    def get(self, key: str):
+        """Cached result for `key` (arrays memory-mapped), or None."""
+        arr_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "rb") as fh:
+                meta = pickle.load(fh)
+            arr = np.load(arr_path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        for path in (arr_path, meta_path):
+            os.utime(path)                                    # mark as recently used
+        return _join(arr, meta)
+
+    def put(self, key: str, result) -> None:
+        """Store `result` under `key` (atomic per file), then evict to max_bytes."""
+        arr, meta = _split(result)
+        arr_path, meta_path = self._paths(key)
+        for path, write in ((arr_path, lambda fh: np.save(fh, arr)),
+                            (meta_path, lambda fh: pickle.dump(meta, fh))):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                write(fh)
+            os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = {}
+        for path in self.directory.glob("*.npy"):
+            key = path.name[:-len(".npy")]
+            meta_path = self._paths(key)[1]
+            try:
+                st, sm = path.stat(), meta_path.stat()
+            except FileNotFoundError:
+                continue
+            entries[key] = (max(st.st_mtime, sm.st_mtime), st.st_size + sm.st_size)
+        total = sum(size for _, size in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k][0]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                path.unlink(missing_ok=True)
+            total -= entries[key][1]
+
+    def clear(self) -> None:
+        for key in {p.name.split(".")[0] for p in self.directory.glob("*.npy")}:
+            for path in self._paths(key):
+                path.unlink(missing_ok=True)
+
+    def __call__(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs), served from the cache when the same call was stored."""
+        key = content_key(fn, *args, **kwargs)
+        result = self.get(key)
+        if result is None:
+            result = fn(*args, **kwargs)
+            self.put(key, result)
+        return result
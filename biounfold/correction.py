@@ -0,0 +1,1027 @@
+"""
+Batch correction — Batch Align and minimal ComBat.
+
+Importable home of the corrections used in the BioUnfold #5 notebooks
+(`bu005_alpha_batch_align`, `bu005_beta_combat`).
+
+All functions take a features × samples matrix and per-sample labels
+aligned to its columns. Importing this module does no work.
+"""
+import hashlib
+import inspect
+import warnings
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Normal-consistency factors: sd ≈ _MAD_SCALE·MAD (1 / Φ⁻¹(0.75)), and
+# var ≈ trimmed var / truncnorm var (_trim_consistency; scipy.stats loads lazily)
+_MAD_SCALE = 1.482602218505602
+
+
+def _zscore_features(X: pd.DataFrame):
+    """
+    Z-score per feature (rows) across samples (cols).
+    NaNs are skipped (mean/std over observed values) and stay NaN in Z.
+    Returns: Z, mean, std
+    """
+    mean = X.mean(axis=1)
+    std = X.std(axis=1, ddof=1).replace(0, np.nan).fillna(1.0)
+    Z = X.sub(mean, axis=0).div(std, axis=0)
+    return Z, mean, std
+
+
+# Design projections keyed by design fingerprint (small LRU; p × N each)
+_PROJECTION_CACHE = OrderedDict()
+_PROJECTION_CACHE_SIZE = 8
+
+
+def _design_projection(D: np.ndarray) -> np.ndarray:
+    """
+    OLS projection P = (DᵀD)⁺ Dᵀ (p × samples) for a design D (samples × p),
+    so Betaᵀ = P Zᵀ. Computed once per distinct design and cached.
+    """
+    D = np.ascontiguousarray(D, dtype=float)
+    key = (D.shape, hashlib.blake2b(D.tobytes(), digest_size=16).hexdigest())
+    P = _PROJECTION_CACHE.get(key)
+    if P is not None:
+        _PROJECTION_CACHE.move_to_end(key)
+        return P
+
+    # OLS: solve Z ≈ X β by minimizing ||Z - Xβ||².
+    # Intercept captures baseline; Group coefficient captures group difference.
+    # This isolates biological signal so batch correction does not remove it.
+    # With X = QR (thin QR), (XᵀX)⁺Xᵀ = R⁺Qᵀ — only the small p×p factor is
+    # pseudo-inverted, and rank-deficient designs are still handled.
+    Q, Rq = np.linalg.qr(D)
+    P = np.linalg.pinv(Rq) @ Q.T
+    _PROJECTION_CACHE[key] = P
+    if len(_PROJECTION_CACHE) > _PROJECTION_CACHE_SIZE:
+        _PROJECTION_CACHE.popitem(last=False)
+    return P
+
+
+def _design_coefficients(Z: np.ndarray, D: np.ndarray) -> np.ndarray:
+    """
+    Feature-wise OLS coefficients for Z (features × samples) ~ D (samples × p).
+    Returns: Beta (features × p), so that the fitted design part is Beta @ Dᵀ.
+
+    Features with NaNs are fit on their observed samples only: their normal
+    equations (Σ_obs d dᵀ) β = Σ_obs d z are built for all such features at
+    once (one G×N @ N×p² product) and solved as a stacked pseudo-inverse.
+    """
+    obs = ~np.isnan(Z)
+    full = obs.all(axis=1)
+    if full.all():
+        # Solve feature-wise in one go: Beta = Z Pᵀ
+        return Z @ _design_projection(D).T
+
+    N, p = D.shape
+    Beta = np.empty((Z.shape[0], p))
+    if full.any():
+        Beta[full] = Z[full] @ _design_projection(D).T
+    part = ~full
+    M = obs[part].astype(float)
+    XtX = (M @ (D[:, :, None] * D[:, None, :]).reshape(N, p * p)).reshape(-1, p, p)
+    XtZ = np.where(obs[part], Z[part], 0.0) @ D
+    Beta[part] = (np.linalg.pinv(XtX) @ XtZ[:, :, None])[:, :, 0]
+    return Beta
+
+
+def _remove_design(R: np.ndarray, D: np.ndarray | None):
+    """
+    Subtract the OLS design fit from R (features × samples) in place.
+    Returns Beta (None without a design); the fitted part Beta @ Dᵀ is
+    never stored — recompute it where it is added back.
+    """
+    if D is None:
+        return None
+    Beta = _design_coefficients(R, D)
+    R -= Beta @ D.T
+    return Beta
+
+
+def _fit_design(Z: pd.DataFrame, design: pd.DataFrame | None):
+    """
+    If a design is provided, fit Z ~ design (OLS) feature-wise and return:
+      fitted (design part) and residuals R = Z - fitted.
+    If no design, fitted = 0.0 (a scalar, nothing is allocated) and R = Z.
+    """
+    if design is None:
+        return 0.0, Z.copy()
+
+    Xmat = design.loc[Z.columns].to_numpy(dtype=float)
+    fitted = _design_coefficients(Z.to_numpy(dtype=float), Xmat) @ Xmat.T
+
+    fitted_df = pd.DataFrame(fitted, index=Z.index, columns=Z.columns)
+    R = Z - fitted_df
+    return fitted_df, R
+
+
+def _batch_segments(batch: pd.Series, columns: pd.Index):
+    """
+    Encode per-sample batch labels as contiguous segments.
+    Returns: codes (per sample), levels, order (stable sort of samples by batch),
+             counts (samples per level), starts (segment offsets in sorted order).
+    """
+    bcat = pd.Categorical(batch.loc[columns])
+    codes = bcat.codes.astype(np.intp)
+    levels = list(bcat.categories)
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=len(levels))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return codes, levels, order, counts, starts
+
+
+def _segment_center(Rs: np.ndarray, counts: np.ndarray, starts: np.ndarray,
+                    return_counts: bool = False):
+    """
+    Per-segment mean and variance (ddof=1) along the columns of a
+    batch-sorted matrix, in one sweep of segment reductions.
+    Rs is centered in place (each segment minus its own mean).
+
+    NaNs are treated as missing: sums run over observed values and each
+    feature × level cell uses its own observed count.
+
+    Cells whose observed values are all equal (max == min: dropout, all-zero
+    counts) take that value as their mean, so their residuals and variance
+    are exactly 0. The rounded segment sum / count would leave residuals of
+    ~1e-17 and a variance of ~1e-34 — which _guard_var does not catch, and
+    which would blow them up to ±1 sd.
+
+    Returns: mean, var — features × levels; var is NaN where a cell has
+             < 2 observations (mean is 0 where it has none).
+             With return_counts=True also the observed counts per cell.
+    """
+    G, B = Rs.shape[0], len(counts)
+    nz = counts > 0
+    mean = np.zeros((G, B), dtype=Rs.dtype)
+    var = np.full((G, B), np.nan, dtype=Rs.dtype)
+    missing = np.isnan(Rs)
+    if not missing.any():
+        n_obs = np.broadcast_to(counts, (G, B))
+        if nz.any():
+            # reduceat needs strictly increasing offsets, so skip empty levels
+            hi = np.maximum.reduceat(Rs, starts[nz], axis=1)
+            mean[:, nz] = np.add.reduceat(Rs, starts[nz], axis=1) / counts[nz]
+            mean[:, nz] = np.where(hi == np.minimum.reduceat(Rs, starts[nz], axis=1), hi, mean[:, nz])
+            Rs -= np.repeat(mean, counts, axis=1)
+            ss = np.add.reduceat(np.square(Rs), starts[nz], axis=1)
+            many = counts > 1
+            var[:, many] = ss[:, many[nz]] / (counts[many] - 1)
+        return (mean, var, n_obs) if return_counts else (mean, var)
+
+    n_obs = np.zeros((G, B), dtype=np.intp)
+    if nz.any():
+        n_obs[:, nz] = np.add.reduceat(~missing, starts[nz], axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            hi = np.fmax.reduceat(Rs, starts[nz], axis=1)
+            sums = np.add.reduceat(np.where(missing, 0.0, Rs), starts[nz], axis=1)
+            mean[:, nz] = np.where(n_obs[:, nz] > 0, sums / n_obs[:, nz], 0.0)
+            mean[:, nz] = np.where(hi == np.fmin.reduceat(Rs, starts[nz], axis=1), hi, mean[:, nz])
+            Rs -= np.repeat(mean, counts, axis=1)
+            ss = np.add.reduceat(np.where(missing, 0.0, np.square(Rs)), starts[nz], axis=1)
+            var[:, nz] = np.where(n_obs[:, nz] > 1, ss / (n_obs[:, nz] - 1), np.nan)
+    return (mean, var, n_obs) if return_counts else (mean, var)
+
+
+def _guard_var(var: np.ndarray) -> np.ndarray:
+    """Replace undefined (NaN/Inf) or zero variances by 1.0, in place."""
+    var[~np.isfinite(var) | (var <= 0)] = 1.0
+    return var
+
+
+@lru_cache(maxsize=None)
+def _trim_consistency(trim: float) -> float:
+    """Variance of a standard normal truncated to its central 1 − 2·trim share."""
+    from scipy.stats import norm, truncnorm
+    z = norm.ppf(1.0 - trim)
+    return float(truncnorm.var(-z, z))
+
+
+def _robust_moments(S: np.ndarray, m: np.ndarray, robust: str, trim: float):
+    """
+    Robust location and variance of every cell of a features × levels ×
+    width tile, each cell's values sorted along the last axis (NaNs last)
+    with m observed. S is overwritten.
+
+    "median"  : median and (1.4826·MAD)²
+    "trimmed" : mean and variance (ddof=1) of the central 1 − 2·trim share,
+                the variance rescaled to be consistent with a normal's
+
+    Order statistics are gathers at their rank; the trimmed moments are sums
+    over the kept ranks. Returns: loc, var — features × levels; var is NaN
+    for cells with < 2 observations (loc is 0 for cells with none).
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if robust == "median":
+            lo, hi = np.maximum(m - 1, 0)[..., None] // 2, (m // 2)[..., None]
+            loc = 0.5 * (np.take_along_axis(S, lo, 2) + np.take_along_axis(S, hi, 2))
+            S -= loc                                              # → sorted |deviations|
+            np.abs(S, out=S)
+            S.sort(axis=2)
+            var = np.square(_MAD_SCALE * 0.5 * (np.take_along_axis(S, lo, 2)
+                                                + np.take_along_axis(S, hi, 2)))
+            loc, var = loc[..., 0], var[..., 0]
+        else:
+            j = np.arange(S.shape[2])
+            k = (trim * m).astype(np.intp)
+            c = m - 2 * k
+            keep = (j >= k[..., None]) & (j < (m - k)[..., None])
+            first = S[..., 0]
+            flat = first == np.take_along_axis(S, np.maximum(m - 1, 0)[..., None], 2)[..., 0]
+            loc = np.where(keep, S, 0.0).sum(axis=2) / c
+            loc = np.where(flat, first, loc)                     # constant cells: exact, var 0
+            S -= loc[..., None]
+            var = np.where(keep, np.square(S), 0.0).sum(axis=2) / (c - 1)
+            if trim > 0:
+                var /= _trim_consistency(trim)
+    return np.where(m > 0, loc, 0.0), np.where(m > 1, var, np.nan)
+
+
+def _segment_robust(Rs: np.ndarray, counts: np.ndarray, starts: np.ndarray,
+                    robust: str, trim: float = 0.1):
+    """
+    Robust counterpart of _segment_center (see _robust_moments): per-segment
+    location and variance of a batch-sorted matrix, Rs centered in place.
+
+    Levels are vectorized, not looped: the segments of all levels whose size
+    rounds up to the same width are gathered into NaN-padded features ×
+    levels × width tiles (~1 MB, so every pass stays in cache) and sorted
+    along the last axis, NaNs and padding last — numpy's vectorized sort
+    beats a two-rank np.partition here. Each cell uses its own observed count.
+    Returns: loc, var — features × levels (loc 0 / var NaN for empty cells).
+    """
+    G, B = Rs.shape[0], len(counts)
+    loc = np.zeros((G, B))
+    var = np.full((G, B), np.nan)
+    nz = counts > 0
+    if not nz.any():
+        return loc, var
+    missing = np.isnan(Rs)
+    n_obs = None
+    if missing.any():
+        n_obs = np.zeros((G, B), dtype=np.intp)
+        n_obs[:, nz] = counts[nz] - np.add.reduceat(missing, starts[nz], axis=1)
+    # padded widths: counts rounded up to a multiple of 2**e, e = floor(log2 n) − 2,
+    # so padding costs at most 25% and there are at most 4 widths per octave
+    step = 1 << np.maximum(np.floor(np.log2(np.maximum(counts, 1))).astype(int) - 2, 0)
+    width = -(-counts // step) * step
+    for w in np.unique(width[nz]):
+        lv = np.flatnonzero((width == w) & nz)
+        pad = np.arange(w) >= counts[lv, None]
+        adjacent = not pad.any() and (np.diff(starts[lv]) == w).all()
+        cols = np.where(pad, 0, starts[lv, None] + np.arange(w))
+        tile = max(1, (1 << 17) // (len(lv) * w))
+        for g in range(0, G, tile):
+            rows = slice(g, g + tile)
+            if adjacent:                                          # full segments side by side
+                S = Rs[rows, starts[lv[0]]:starts[lv[0]] + w * len(lv)].reshape(-1, len(lv), w).copy()
+            else:
+                S = Rs[rows][:, cols]                             # features × levels × width
+                S[:, pad] = np.nan
+            S.sort(axis=2)
+            m = n_obs[rows, lv] if n_obs is not None else np.broadcast_to(counts[lv], S.shape[:2])
+            loc[rows, lv], var[rows, lv] = _robust_moments(S, m, robust, trim)
+    Rs -= np.repeat(loc, counts, axis=1)
+    return loc, var
+
+
+def _nan_row_stats(blk: np.ndarray, ddof: int = 1):
+    """Per-row mean and std (NaN-skipping only when the block has NaNs)."""
+    if not np.isnan(blk).any():
+        return blk.mean(axis=1), blk.std(axis=1, ddof=ddof)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)   # all-NaN rows
+        return np.nanmean(blk, axis=1), np.nanstd(blk, axis=1, ddof=ddof)
+
+
+def _dense_inputs(X, batch, design):
+    """
+    Raw values, batch layout and design matrix for the dense kernels.
+    DataFrames are aligned by label; ndarrays take batch/design in column order.
+    """
+    if isinstance(X, pd.DataFrame):
+        cols, Xv = X.columns, X.to_numpy()
+    else:
+        Xv = np.asarray(X)
+        cols = pd.RangeIndex(Xv.shape[1])
+        batch = pd.Series(np.asarray(batch), index=cols)
+        if isinstance(design, pd.DataFrame):
+            design = design.set_axis(cols)
+    if design is None:
+        D = None
+    elif isinstance(design, pd.DataFrame):
+        D = design.loc[cols].to_numpy(dtype=float)
+    else:
+        D = np.asarray(design, dtype=float)
+    return Xv, _batch_segments(batch, cols), D
+
+
+def _work_buffer(shape, out, dtype):
+    """The one full-size buffer of the fused kernels: `out` if given, else new."""
+    if out is None:
+        return np.empty(shape, dtype=dtype or np.float64)
+    if out.shape != shape:
+        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+    return out
+
+
+def _row_blocks(G: int, N: int, chunk_size: int | None):
+    """Feature-row blocks; by default ~32 MB of float64 per block temporary."""
+    chunk = chunk_size or max(1, (1 << 22) // max(N, 1))
+    return [(s, min(s + chunk, G)) for s in range(0, G, chunk)]
+
+
+def _standardize_block(blk: np.ndarray, D):
+    """Z-score a float64 row block in place and remove the design. Returns mu, sd, Beta."""
+    mu, sd = _nan_row_stats(blk)
+    sd = _guard_var(sd)
+    blk -= mu[:, None]
+    blk /= sd[:, None]
+    return mu, sd, _remove_design(blk, D)
+
+
+def _restore_block(blk: np.ndarray, mu, sd, Beta, D):
+    """Add the design part back and de-standardize a row block, in place."""
+    if Beta is not None:
+        blk += Beta @ D.T
+    blk *= sd[:, None]
+    blk += mu[:, None]
+
+
+def _combat_block_moments(blk: np.ndarray, D, order, counts, starts, eps: float):
+    """
+    ComBat pass 1 on a float64 row block: standardize and remove the design
+    in place (blk then holds the residuals), then per-batch moments.
+    Returns: mu, sd, Beta, sigma2_g, gamma_hat, delta_hat (unguarded), n_obs.
+    """
+    mu, sd, Beta = _standardize_block(blk, D)
+    # residual variance across all (observed) samples (for s2_gamma)
+    sigma2_g = _nan_row_stats(blk)[1] ** 2 + eps
+    Rs = blk[:, order]                                 # batch-sorted; centered in place
+    gamma_hat, delta_hat, n_obs = _segment_center(Rs, counts, starts, return_counts=True)
+    return mu, sd, Beta, sigma2_g, gamma_hat, delta_hat, n_obs
+
+
+def _combat_block_apply(blk: np.ndarray, codes, mu, sd, Beta, D, gamma_star, delta_star):
+    """ComBat pass 2 on a block of residuals, in place: adjust, add design, de-standardize."""
+    blk -= gamma_star[:, codes]
+    blk /= np.sqrt(delta_star)[:, codes]
+    _restore_block(blk, mu, sd, Beta, D)
+
+
+def _check_lowrank(out, dtype, chunk_size):
+    """output="lowrank" returns a lazy object: there is no buffer to fill or block over."""
+    if out is not None or dtype is not None or chunk_size is not None:
+        raise ValueError("out, dtype and chunk_size do not apply to output='lowrank'")
+
+
+def _wrap(out: np.ndarray, X):
+    if isinstance(X, pd.DataFrame):
+        return pd.DataFrame(out, index=X.index, columns=X.columns, copy=False)
+    return out
+
+
+def batch_align_minimal(X: pd.DataFrame,
+                        batch: pd.Series,
+                        design: pd.DataFrame | None = None,
+                        output: str = "dense",
+                        out: np.ndarray | None = None,
+                        dtype=None,
+                        chunk_size: int | None = None,
+                        robust: str | None = None,
+                        trim: float = 0.1,
+                        rank: int | None = None):
+    """
+    Minimal Batch Align (location–scale) without shrinkage.
+
+    X      : features × samples (DataFrame, ndarray, or scipy.sparse CSR/CSC)
+    batch  : per-sample batch labels (index aligned to X.columns;
+             array-like in column order for ndarray/sparse X), or a
+             samples × levels DataFrame of nested labels (outer → inner)
+             for a level-by-level correction, see biounfold.hierarchical
+    design : optional design matrix (e.g., intercept + biology) to preserve
+    output : "dense", "factors" to get a lazy sparse.BatchFactors
+             (per-feature, per-batch scale/offset) instead of a matrix, or
+             "lowrank" to correct only the top `rank` PCA scores and get a
+             lazy lowrank.LowRankCorrection
+    out    : optional features × samples array to write into (may be X's own
+             buffer for an in-place correction)
+    dtype  : dtype of the output when `out` is not given (e.g. np.float32)
+    chunk_size : feature rows per block (default: ~32 MB per block temporary)
+             out / dtype / chunk_size also hold for sparse X and nested
+             labels (the factors are applied block by block); with
+             output="factors" only chunk_size applies, with "lowrank" none
+    robust : None (per-batch mean/variance), "median" (median and MAD) or
+             "trimmed" (mean/variance of the central 1 − 2·trim share)
+    trim   : share trimmed from each tail with robust="trimmed"
+    rank   : components corrected with output="lowrank" (default 200)
+
+    Mixed precision: X may be float32 and the output float32; blocks are
+    always computed in float64, so the output is the float64 result rounded
+    once, |Δ| ≤ 2**-24·|X_adj| (relative to the same input).
+
+    Robust alignment resists outlying samples (dead wells, saturated images)
+    in the per-batch estimates. Both robust scales are scaled to match the
+    standard deviation on normal data. Batches of similar size are sorted
+    together in one vectorized pass (NaN-padded to a shared width), and the
+    order statistics of all their features are gathered at once — no
+    per-batch loop, so many small batches cost no more than a few large ones.
+
+    Every step is per feature, so the correction runs fused, block by block:
+    standardize → remove design → align → add design → de-standardize, in
+    float64 temporaries of one block, written straight into the output.
+    Peak memory is input + output + a few blocks.
+
+    Returns: X_aligned (same shape as X). Missing values (NaN) are skipped
+    in every mean/variance and the design fit, and stay NaN in the output.
+    Sparse X or output="factors" use the moment path in biounfold.sparse
+    (design=None only).
+    """
+    if robust not in (None, "median", "trimmed"):
+        raise ValueError(f"unknown robust {robust!r}; expected None, 'median' or 'trimmed'")
+    if robust is not None and not 0 <= trim < 0.5:
+        raise ValueError("trim must be in [0, 0.5)")
+    if output == "lowrank":
+        _check_lowrank(out, dtype, chunk_size)
+        from .lowrank import correct_lowrank
+        return correct_lowrank(X, batch, design, method="align", rank=rank,
+                               robust=robust, trim=trim)
+    if robust is not None and (isinstance(batch, pd.DataFrame) or sp.issparse(X)
+                               or output != "dense"):
+        raise ValueError("robust alignment needs dense X, flat batch labels and output='dense'")
+    if isinstance(batch, pd.DataFrame):
+        from .hierarchical import correct_hierarchical
+        return correct_hierarchical(X, batch, design, method="align", output=output,
+                                    out=out, dtype=dtype, chunk_size=chunk_size)
+    if sp.issparse(X) or output != "dense":
+        from .sparse import correct_sparse
+        return correct_sparse(X, batch, design, method="align", output=output,
+                              out=out, dtype=dtype, chunk_size=chunk_size)
+
+    Xv, (_, _, order, counts, starts), D = _dense_inputs(X, batch, design)
+    X_adj = _work_buffer(Xv.shape, out, dtype)
+    for s, e in _row_blocks(*Xv.shape, chunk_size):
+        blk = np.array(Xv[s:e], dtype=np.float64)
+
+        # 1–2) Standardize features globally, remove design effects (optional)
+        mu, sd, Beta = _standardize_block(blk, D)
+
+        # 3–4) Per-batch mean/var (or robust loc/scale) on residuals, then
+        #      align every batch at once: remove its loc, scale to unit variance
+        Rs = blk[:, order]
+        if robust is None:
+            _, var = _segment_center(Rs, counts, starts)
+        else:
+            _, var = _segment_robust(Rs, counts, starts, robust, trim)
+        Rs /= np.repeat(np.sqrt(_guard_var(var)), counts, axis=1)
+        blk[:, order] = Rs
+
+        # 5) Recombine design and de-standardize to original scale
+        _restore_block(blk, mu, sd, Beta, D)
+        X_adj[s:e] = blk
+    return _wrap(X_adj, X)
+
+
+def _eb_priors(gamma_mean, gamma_var, delta_mean, delta_var):
+    """
+    Per-batch EB hyperparameters from across-feature moments of the raw
+    estimates: gamma ~ N(gamma0, tau2), delta ~ Inv-Gamma(a, b) (method of moments).
+    Returns: gamma0, tau2, a, b — one value per batch.
+    """
+    gamma0 = gamma_mean                                # batch-wise mean across features
+    tau2   = np.where(gamma_var > 1e-6, gamma_var, 1e-3)   # guard
+
+    m = delta_mean                                     # per-batch mean of variances across features
+    v = np.where(delta_var > 1e-12, delta_var, (m**2) * 10.0)  # guard tiny var
+    a = 2.0 + (m**2) / v
+    b = m * (a - 1.0)
+    return gamma0, tau2, a, b
+
+
+def _eb_iterate(gamma_hat, delta_hat, n_j, priors, max_iter: int = 100, tol: float = 1e-4):
+    """
+    Iterative parametric EB (as in the reference ComBat): alternate
+      gamma* = (tau2·n·gamma_hat + delta*·gamma0) / (tau2·n + delta*)
+      delta* = (½·S + b) / (n/2 + a - 1),  S = Σ(r - gamma*)² = (n-1)·delta_hat + n·(gamma_hat - gamma*)²
+    until the relative change of both is below `tol`. n is per batch or per
+    feature × batch cell (observed counts).
+
+    S comes from the sufficient statistics, so no pass over the data is needed.
+    Every feature × batch cell iterates in one broadcasted computation; cells
+    that converge drop out of the active set and cost nothing afterwards.
+    Returns: gamma_star, delta_star, n_iter (features × batches).
+    """
+    gamma0, tau2, a, b = priors
+    shape = gamma_hat.shape
+    flat = lambda v: np.broadcast_to(v, shape).ravel()
+    gh, dh = flat(gamma_hat), flat(delta_hat)
+    n = flat(np.asarray(n_j, dtype=float))
+    g0, t2 = flat(gamma0[None, :]), flat(tau2[None, :])
+    aa, bb = flat(a[None, :]), flat(b[None, :])
+
+    g, d = gh.copy(), dh.copy()
+    n_iter = np.zeros(g.size, dtype=int)
+    active = np.arange(g.size)
+    tiny = np.finfo(float).tiny
+    for it in range(1, max_iter + 1):
+        if active.size == 0:
+            break
+        nn, g_old, d_old = n[active], g[active], d[active]
+        g_new = (t2[active] * nn * gh[active] + d_old * g0[active]) / (t2[active] * nn + d_old)
+        S = (nn - 1.0) * dh[active] + nn * (gh[active] - g_new) ** 2
+        d_new = (0.5 * S + bb[active]) / (0.5 * nn + aa[active] - 1.0)
+        change = np.maximum(np.abs(g_new - g_old) / np.maximum(np.abs(g_old), tiny),
+                            np.abs(d_new - d_old) / np.maximum(d_old, tiny))
+        g[active], d[active] = g_new, d_new
+        n_iter[active] = it
+        active = active[~(change < tol)]
+    return g.reshape(shape), d.reshape(shape), n_iter.reshape(shape)
+
+
+def _eb_nonparametric(gamma_hat, delta_hat, n_j,
+                      block_size: int = 512,
+                      n_prior: int | None = None,
+                      random_state=None):
+    """
+    Non-parametric EB (as in the reference ComBat): the prior for each
+    feature is the empirical distribution of the other features' (gamma, delta),
+    weighted by the Normal likelihood of this feature's batch data,
+      w_im ∝ (2π d_m)^(-n/2) · exp(-S_im / (2 d_m)),
+      S_im = Σ_k (r_ik - g_m)² = (n-1)·delta_hat_i + n·(gamma_hat_i - g_m)².
+
+    S comes from the sufficient statistics, so each tile is a dense
+    (block_size × n_prior) log-weight computation; a feature is left out
+    of its own prior. Peak extra memory is about 2 × block_size × n_prior floats.
+
+    n_prior      : random subset of features used as the empirical prior
+                   (None = all features, O(G²) per batch)
+    random_state : seed for that subset
+
+    Returns: gamma_star, delta_star (features × batches).
+    """
+    G, B = gamma_hat.shape
+    if n_prior is None or n_prior >= G:
+        idx = np.arange(G)
+    else:
+        idx = np.sort(np.random.default_rng(random_state).choice(G, n_prior, replace=False))
+
+    n_all = np.broadcast_to(np.asarray(n_j, dtype=float), (G, B))
+    gamma_star = np.empty_like(gamma_hat)
+    delta_star = np.empty_like(delta_hat)
+    for j in range(B):
+        g_p, d_p = gamma_hat[idx, j], delta_hat[idx, j]
+        log_2pi_d = np.log(2.0 * np.pi * d_p)                  # per prior feature
+        for s in range(0, G, block_size):
+            e = min(s + block_size, G)
+            n = n_all[s:e, j, None]                             # observed count per row
+            logw = (gamma_hat[s:e, j, None] - g_p[None, :]) ** 2
+            logw *= n
+            logw += (n - 1.0) * delta_hat[s:e, j, None]
+            logw /= -2.0 * d_p[None, :]
+            logw -= 0.5 * n * log_2pi_d[None, :]
+            # leave-one-out: drop each feature from its own prior
+            lo, hi = np.searchsorted(idx, [s, e])
+            logw[idx[lo:hi] - s, np.arange(lo, hi)] = -np.inf
+            logw -= logw.max(axis=1, keepdims=True)
+            w = np.exp(logw, out=logw)
+            wsum = w.sum(axis=1)
+            gamma_star[s:e, j] = (w @ g_p) / wsum
+            delta_star[s:e, j] = (w @ d_p) / wsum
+
+    # a feature with no usable prior keeps its raw estimate
+    bad = ~(np.isfinite(gamma_star) & np.isfinite(delta_star))
+    gamma_star[bad] = gamma_hat[bad]
+    delta_star[bad] = delta_hat[bad]
+    return gamma_star, delta_star
+
+
+def _eb_posterior(gamma_hat, delta_hat, n_j, sigma2_g, priors, eps: float = 1e-8,
+                  iterative: bool = False, max_iter: int = 100, tol: float = 1e-4,
+                  parametric: bool = True, block_size: int = 512,
+                  n_prior: int | None = None, random_state=None):
+    """
+    EB posterior means of per-batch location (gamma_star) and variance
+    (delta_star), broadcast over features × batches.
+
+    iterative=False  : one closed-form step (gamma's sampling variance from sigma2_g)
+    iterative=True   : fixed-point gamma*/delta* iteration, see _eb_iterate
+    parametric=False : empirical (non-parametric) prior, see _eb_nonparametric;
+                       `priors` and `iterative` are then unused
+
+    Returns: gamma_star, delta_star, n_iter (per batch: iterations until
+             every feature converged; 1 for single-step estimates).
+    """
+    gamma0, tau2, a, b = priors
+    B = gamma_hat.shape[1]
+    if not parametric:
+        gamma_star, delta_star = _eb_nonparametric(gamma_hat, delta_hat, n_j,
+                                                   block_size, n_prior, random_state)
+        return gamma_star, np.clip(delta_star, 1e-3, 1e3), np.ones(B, dtype=int)
+    if iterative:
+        gamma_star, delta_star, n_iter = _eb_iterate(gamma_hat, delta_hat, n_j, priors, max_iter, tol)
+        return gamma_star, np.clip(delta_star, 1e-3, 1e3), n_iter.max(axis=0, initial=0)
+
+    # samples per batch (J) or observed samples per feature/batch (G×J)
+    n = np.asarray(n_j)
+    n = n[None, :] if n.ndim == 1 else n
+
+    # sampling variance of gamma_hat (per feature, per batch)
+    s2_gamma = sigma2_g[:, None] / np.maximum(n, 1)
+
+    # posterior mean (elementwise): (tau2*gamma_hat + s2*gamma0) / (tau2 + s2)
+    gamma_star = (tau2[None, :] * gamma_hat + s2_gamma * gamma0[None, :]) / (tau2[None, :] + s2_gamma + eps)
+
+    # posterior parameters per feature/batch
+    a_star = a[None, :] + 0.5 * np.maximum(n, 1)                 # 1×J or G×J
+    b_star = b[None, :] + 0.5 * np.maximum(n - 1, 0) * delta_hat  # G×J
+
+    # posterior mean of delta: E[δ | data] = b_star / (a_star - 1)
+    den = np.maximum(a_star - 1.0, 1.0001)             # avoid divide by ~0
+    delta_star = b_star / den
+    delta_star = np.clip(delta_star, 1e-3, 1e3)
+    return gamma_star, delta_star, np.ones(B, dtype=int)
+
+
+def _combat_eb(gamma_hat: np.ndarray,
+               delta_hat: np.ndarray,
+               n_j: np.ndarray,
+               sigma2_g: np.ndarray,
+               eps: float = 1e-8,
+               **posterior):
+    """
+    Parametric EB shrinkage of per-batch residual means/variances,
+    broadcast over all features × batches at once.
+
+    gamma_hat, delta_hat : features × batches raw estimates
+    n_j                  : samples per batch, or observed samples per
+                           feature × batch cell when data have NaNs
+    sigma2_g             : per-feature residual variance across all samples
+    posterior            : iterative / max_iter / tol and parametric / block_size /
+                           n_prior / random_state, see _eb_posterior
+
+    Returns: gamma_star, delta_star (features × batches), the
+             per-batch priors (gamma0, tau2, a, b) and per-batch n_iter.
+    """
+    empty = np.broadcast_to(n_j, gamma_hat.shape) == 0
+    if empty.any():
+        # cells with no observations carry no information: leave them out of
+        # the priors, and let their posterior fall back to the prior mean
+        gh = np.where(empty, np.nan, gamma_hat)
+        priors = _eb_priors(np.nanmean(gh, axis=0), np.nanvar(gh, axis=0, ddof=1),
+                            delta_hat.mean(axis=0), delta_hat.var(axis=0, ddof=1))
+        gamma_hat = np.where(empty, priors[0][None, :], gamma_hat)
+    else:
+        priors = _eb_priors(gamma_hat.mean(axis=0), gamma_hat.var(axis=0, ddof=1),
+                            delta_hat.mean(axis=0), delta_hat.var(axis=0, ddof=1))
+    gamma_star, delta_star, n_iter = _eb_posterior(gamma_hat, delta_hat, n_j, sigma2_g, priors, eps, **posterior)
+    return gamma_star, delta_star, priors, n_iter
+
+
+def combat_minimal(X: pd.DataFrame,
+                   batch: pd.Series,
+                   design: pd.DataFrame | None = None,
+                   eps: float = 1e-8,
+                   iterative: bool = False,
+                   max_iter: int = 100,
+                   tol: float = 1e-4,
+                   parametric: bool = True,
+                   block_size: int = 512,
+                   n_prior: int | None = None,
+                   random_state=None,
+                   output: str = "dense",
+                   out: np.ndarray | None = None,
+                   dtype=None,
+                   chunk_size: int | None = None,
+                   rank: int | None = None) -> pd.DataFrame:
+    """
+    Minimal ComBat (parametric EB), optionally design-aware.
+    - Standardize features globally (z-score).
+    - Optionally regress out a design (e.g., intercept + biology) to preserve it.
+    - Estimate per-batch mean (gamma_hat) & variance (delta_hat) on the residuals.
+    - Shrink gamma_hat toward batch-wise global mean via Normal–Normal EB.
+    - Shrink delta_hat via Inverse-Gamma EB (method-of-moments priors).
+    - Normalize residuals with EB-shrunk params, add the design back, de-standardize.
+
+    design : optional samples × p design matrix (index aligned to X.columns).
+             Its OLS projection is computed once (QR) and cached per design.
+
+    iterative=True alternates the gamma*/delta* updates until the relative
+    change is below `tol` (at most `max_iter` rounds), like the reference
+    ComBat; ComBat(iterative=True).n_iter_ reports iterations per batch.
+
+    parametric=False replaces the Normal/Inverse-Gamma priors with the
+    empirical distribution of the other features (non-parametric ComBat),
+    evaluated in tiles of `block_size` features; `n_prior` subsamples the
+    features forming that prior (seeded by `random_state`).
+
+    X may also be scipy.sparse (CSR/CSC, batch in column order), and
+    output="factors" returns a lazy sparse.BatchFactors instead of a matrix;
+    both use the moment path in biounfold.sparse (design=None only).
+
+    batch may be a DataFrame of nested labels (e.g. run, plate; outer →
+    inner): ComBat then runs level by level on nested batches, see
+    biounfold.hierarchical (design=None only).
+
+    output="lowrank" corrects the top `rank` (default 200) PCA scores of the
+    standardized X instead of every feature, and returns a lazy
+    lowrank.LowRankCorrection (low-rank correction plus untouched residual).
+    Components are not exchangeable the way features are, so low-rank ComBat
+    does no EB shrinkage: each component gets its own location/scale, i.e.
+    it is Batch Align on the scores. eps and the prior options (iterative,
+    max_iter, tol, parametric, block_size, n_prior) raise ValueError there.
+
+    Missing values (NaN) are skipped in every mean/variance and the design
+    fit, and stay NaN in the output.
+
+    out, dtype, chunk_size : fused execution, see batch_align_minimal. ComBat
+    needs the across-feature priors first, so it makes two block passes: the
+    first parks standardized residuals in the output buffer, the second
+    corrects them there in place. A lower-precision output (e.g. float32)
+    does not park them — pass 2 recomputes them from X — so the result is
+    again one rounding from float64, |Δ| ≤ 2**-24·|X_adj|. Only in place
+    (out=X) in float32 do the parked residuals add 2**-24·sd·|r|/√delta*.
+
+    Assumes: X is features×samples, batch aligns to X.columns, no Infs.
+    """
+    if output == "lowrank":
+        _check_lowrank(out, dtype, chunk_size)
+        eb = dict(eps=eps, iterative=iterative, max_iter=max_iter, tol=tol,
+                  parametric=parametric, block_size=block_size, n_prior=n_prior)
+        defaults = inspect.signature(combat_minimal).parameters
+        changed = [k for k, v in eb.items() if v != defaults[k].default]
+        if changed:
+            raise ValueError(f"output='lowrank' does no EB shrinkage; {changed} do not apply")
+        from .lowrank import correct_lowrank
+        return correct_lowrank(X, batch, design, method="combat", rank=rank,
+                               random_state=random_state)
+    if isinstance(batch, pd.DataFrame):
+        from .hierarchical import correct_hierarchical
+        return correct_hierarchical(X, batch, design, method="combat", output=output, eps=eps,
+                                    out=out, dtype=dtype, chunk_size=chunk_size,
+                                    iterative=iterative, max_iter=max_iter, tol=tol,
+                                    parametric=parametric, block_size=block_size,
+                                    n_prior=n_prior, random_state=random_state)
+    if sp.issparse(X) or output != "dense":
+        from .sparse import correct_sparse
+        return correct_sparse(X, batch, design, method="combat", output=output, eps=eps,
+                              out=out, dtype=dtype, chunk_size=chunk_size,
+                              iterative=iterative, max_iter=max_iter, tol=tol,
+                              parametric=parametric, block_size=block_size,
+                              n_prior=n_prior, random_state=random_state)
+
+    Xv, (codes, _, order, counts, starts), D = _dense_inputs(X, batch, design)
+    G, N = Xv.shape
+    B = len(counts)
+    X_adj = _work_buffer(Xv.shape, out, dtype)
+    blocks = _row_blocks(G, N, chunk_size)
+
+    mu, sd, sigma2_g = np.empty(G), np.empty(G), np.empty(G)
+    Beta = None if D is None else np.empty((G, D.shape[1]))
+    gamma_hat, delta_hat = np.empty((G, B)), np.empty((G, B))
+    n_obs = np.empty((G, B), dtype=np.intp)
+
+    # Residuals are parked in the output only if it holds them exactly or
+    # must (in place); otherwise pass 2 recomputes them from X
+    park = X_adj.dtype == np.float64 or np.may_share_memory(X_adj, Xv)
+
+    # Pass 1 — per block: standardize, remove the design (optional), park the
+    #          residuals in the output, estimate per-batch moments
+    for s, e in blocks:
+        blk = np.array(Xv[s:e], dtype=np.float64)
+        (mu[s:e], sd[s:e], Bb, sigma2_g[s:e], gamma_hat[s:e], delta_hat[s:e],
+         n_obs[s:e]) = _combat_block_moments(blk, D, order, counts, starts, eps)
+        if Bb is not None:
+            Beta[s:e] = Bb
+        if park:
+            X_adj[s:e] = blk
+    _guard_var(delta_hat)
+
+    # EB shrinkage of means and variances (sampling variances use the
+    # observed count of each feature × batch cell)
+    gamma_star, delta_star, _, _ = _combat_eb(gamma_hat, delta_hat, n_obs, sigma2_g, eps,
+                                              iterative=iterative, max_iter=max_iter, tol=tol,
+                                              parametric=parametric, block_size=block_size,
+                                              n_prior=n_prior, random_state=random_state)
+
+    # Pass 2 — adjust residuals with EB-shrunk params, recombine, de-standardize
+    for s, e in blocks:
+        if park:
+            blk = np.array(X_adj[s:e], dtype=np.float64)
+        else:
+            blk = np.array(Xv[s:e], dtype=np.float64)
+            _standardize_block(blk, D)
+        _combat_block_apply(blk, codes, mu[s:e], sd[s:e], None if Beta is None else Beta[s:e],
+                            D, gamma_star[s:e], delta_star[s:e])
+        X_adj[s:e] = blk
+    return _wrap(X_adj, X)
+
+
+class _LocationScaleCorrector:
+    """
+    Shared fit/transform machinery for per-batch location–scale corrections.
+
+    Fitted state (features × batches unless noted):
+      mu_, sd_        : global per-feature standardization
+      beta_           : design coefficients (features × p), or None
+      levels_         : fitted batch levels, in column order of the params
+      n_              : samples seen per level
+      gamma_, delta_  : per-batch residual location / variance applied at transform
+
+    Subclasses only decide how raw per-batch moments become gamma_/delta_.
+    """
+
+    def __init__(self, ref_batch=None):
+        self.ref_batch = ref_batch
+
+    # -- subclass hook -------------------------------------------------
+    def _batch_params(self, gamma_hat, delta_hat, n_j):
+        raise NotImplementedError
+
+    # -- helpers -------------------------------------------------------
+    def _design_matrix(self, design, columns):
+        if design is None:
+            if self.beta_ is not None:
+                raise ValueError("fitted with a design; pass the design for these samples")
+            return None
+        if self.beta_ is None:
+            raise ValueError("fitted without a design; design must be None")
+        return design.loc[columns, self.design_columns_].to_numpy(dtype=float)
+
+    def _residuals(self, X: pd.DataFrame, D):
+        Z = X.to_numpy(dtype=float, copy=True)
+        Z -= self.mu_[:, None]
+        Z /= self.sd_[:, None]
+        if D is not None:
+            Z -= self.beta_ @ D.T
+        return Z
+
+    def _estimate_levels(self, R, batch, columns):
+        """
+        Raw per-batch moments of residuals R for the levels present in `batch`,
+        with samples per level and observed counts per feature × level.
+        """
+        _, levels, order, counts, starts = _batch_segments(batch, columns)
+        keep = counts > 0
+        gamma_hat, delta_hat, n_obs = _segment_center(R[:, order], counts, starts, return_counts=True)
+        _guard_var(delta_hat)
+        levels = [lev for lev, k in zip(levels, keep) if k]
+        return levels, gamma_hat[:, keep], delta_hat[:, keep], counts[keep], n_obs[:, keep]
+
+    def _add_levels(self, levels, gamma_hat, delta_hat, n_j, n_obs):
+        gamma, delta = self._batch_params(gamma_hat, delta_hat, n_obs)
+        if self.ref_batch in levels:
+            # the reference is the target scale: keep its raw moments
+            j = levels.index(self.ref_batch)
+            gamma[:, j] = gamma_hat[:, j]
+            delta[:, j] = delta_hat[:, j]
+        self.levels_ = self.levels_ + list(levels)
+        self.n_ = np.concatenate([self.n_, n_j])
+        self.gamma_ = np.hstack([self.gamma_, gamma])
+        self.delta_ = np.hstack([self.delta_, delta])
+
+    # -- public API ----------------------------------------------------
+    def fit(self, X: pd.DataFrame, batch: pd.Series, design: pd.DataFrame | None = None):
+        """
+        Learn standardization, design coefficients and per-batch parameters.
+        X is features × samples; batch and design are indexed by X.columns.
+        """
+        Xv = X.to_numpy(dtype=float)
+        blab = batch.loc[X.columns]
+        if self.ref_batch is None:
+            ref = slice(None)
+        else:
+            ref = (blab == self.ref_batch).to_numpy()
+            if not ref.any():
+                raise ValueError(f"reference batch {self.ref_batch!r} not found in batch")
+
+        self.mu_ = np.nanmean(Xv[:, ref], axis=1)
+        self.sd_ = _guard_var(np.nanstd(Xv[:, ref], axis=1, ddof=1))
+        self.beta_ = None
+        self.design_columns_ = None
+        R = self._residuals(X, None)
+        if design is not None:
+            self.design_columns_ = list(design.columns)
+            self.beta_ = _remove_design(R, design.loc[X.columns, self.design_columns_].to_numpy(dtype=float))
+        self._fit_global(R)
+
+        G = X.shape[0]
+        self.levels_ = []
+        self.n_ = np.zeros(0, dtype=int)
+        self.gamma_ = np.zeros((G, 0))
+        self.delta_ = np.ones((G, 0))
+        self._add_levels(*self._estimate_levels(R, blab, X.columns))
+        return self
+
+    def _fit_global(self, R):
+        """Hook for statistics pooled over all fitted samples."""
+
+    def partial_fit(self, X: pd.DataFrame, batch: pd.Series, design: pd.DataFrame | None = None):
+        """
+        Add parameters for new batches, reusing the fitted standardization,
+        design coefficients and (for ComBat) global variance.
+        Cost is proportional to the new samples; fitted batches are untouched,
+        so data corrected earlier never changes.
+        """
+        if not hasattr(self, "levels_"):
+            return self.fit(X, batch, design)
+        blab = batch.loc[X.columns]
+        seen = sorted(set(blab.unique()) & set(self.levels_), key=str)
+        if seen:
+            raise ValueError(f"batches already fitted: {seen}")
+        R = self._residuals(X, self._design_matrix(design, X.columns))
+        self._add_levels(*self._estimate_levels(R, blab, X.columns))
+        return self
+
+    def transform(self, X: pd.DataFrame, batch: pd.Series, design: pd.DataFrame | None = None) -> pd.DataFrame:
+        """Correct samples from fitted batches. Returns a features × samples DataFrame."""
+        blab = batch.loc[X.columns]
+        codes = pd.Categorical(blab, categories=self.levels_).codes
+        if (codes < 0).any():
+            unseen = sorted(set(blab[codes < 0]), key=str)
+            raise ValueError(f"batches not fitted (use partial_fit): {unseen}")
+
+        D = self._design_matrix(design, X.columns)
+        R = self._residuals(X, D)
+        R -= self.gamma_[:, codes]
+        R /= np.sqrt(self.delta_[:, codes])
+        if self.ref_batch is not None:
+            # map onto the reference batch's residual location/scale
+            j = self.levels_.index(self.ref_batch)
+            R *= np.sqrt(self.delta_[:, [j]])
+            R += self.gamma_[:, [j]]
+        if D is not None:
+            R += self.beta_ @ D.T
+        R *= self.sd_[:, None]
+        R += self.mu_[:, None]
+        if self.ref_batch is not None:
+            is_ref = codes == self.levels_.index(self.ref_batch)
+            R[:, is_ref] = X.to_numpy(dtype=float)[:, is_ref]
+        return pd.DataFrame(R, index=X.index, columns=X.columns)
+
+    def fit_transform(self, X: pd.DataFrame, batch: pd.Series, design: pd.DataFrame | None = None) -> pd.DataFrame:
+        return self.fit(X, batch, design).transform(X, batch, design)
+
+
+class BatchAlign(_LocationScaleCorrector):
+    """
+    Batch Align as a fitted estimator: per-batch residual mean/variance,
+    no shrinkage. fit_transform matches batch_align_minimal.
+
+    ref_batch : optional level whose samples are left unchanged; standardization
+                comes from it and every other batch is mapped onto it.
+    """
+
+    def _batch_params(self, gamma_hat, delta_hat, n_j):
+        return gamma_hat.copy(), delta_hat.copy()
+
+
+class ComBat(_LocationScaleCorrector):
+    """
+    Parametric-EB ComBat as a fitted estimator. fit_transform matches
+    combat_minimal. Besides the BatchAlign state it keeps
+    sigma2_ (per-feature residual variance from fit) and the per-batch priors
+    gamma0_, tau2_, a_, b_, so a new batch is shrunk with its own priors
+    without revisiting earlier data.
+
+    ref_batch : optional level whose samples are left unchanged (not shrunk).
+    iterative, max_iter, tol : iterative EB, see combat_minimal. n_iter_ holds
+                the iterations each batch needed (1 for the closed-form step).
+    parametric, block_size, n_prior, random_state : non-parametric EB, see combat_minimal.
+    """
+
+    def __init__(self, ref_batch=None, eps: float = 1e-8,
+                 iterative: bool = False, max_iter: int = 100, tol: float = 1e-4,
+                 parametric: bool = True, block_size: int = 512,
+                 n_prior: int | None = None, random_state=None):
+        super().__init__(ref_batch=ref_batch)
+        self.eps = eps
+        self.iterative = iterative
+        self.max_iter = max_iter
+        self.tol = tol
+        self.parametric = parametric
+        self.block_size = block_size
+        self.n_prior = n_prior
+        self.random_state = random_state
+
+    def _fit_global(self, R):
+        self.sigma2_ = np.nanvar(R, axis=1, ddof=1) + self.eps
+        self.gamma0_ = self.tau2_ = self.a_ = self.b_ = np.zeros(0)
+        self.n_iter_ = np.zeros(0, dtype=int)
+
+    def _batch_params(self, gamma_hat, delta_hat, n_j):
+        gamma_star, delta_star, (gamma0, tau2, a, b), n_iter = _combat_eb(
+            gamma_hat, delta_hat, n_j, self.sigma2_, self.eps,
+            iterative=self.iterative, max_iter=self.max_iter, tol=self.tol,
+            parametric=self.parametric, block_size=self.block_size,
+            n_prior=self.n_prior, random_state=self.random_state)
+        self.gamma0_ = np.concatenate([self.gamma0_, gamma0])
+        self.tau2_ = np.concatenate([self.tau2_, tau2])
+        self.a_ = np.concatenate([self.a_, a])
+        self.b_ = np.concatenate([self.b_, b])
+        self.n_iter_ = np.concatenate([self.n_iter_, n_iter])
+        return gamma_star, delta_star
@@ -0,0 +1,280 @@
+"""
+Embedding-space batch correction — mutual nearest neighbours (MNN) and
+Harmony-style iterative soft clustering.
+
+Batch Align and ComBat model a batch as a per-feature shift/scale. Where
+batches differ non-linearly (cell-level profiles, shifted cell-type mixes),
+these engines correct a PCA embedding instead. Both take the usual
+features × samples X and per-sample labels, embed the samples with pca2d
+(n_pcs components of the z-scored features; n_pcs=None uses the rows of X
+as the embedding, e.g. PCA scores, a LowRankCorrection or an earlier
+Embedding), and return the corrected embedding in the same orientation as a
+metrics.Embedding: n_pcs × samples scores, dimensions PC1.. and the
+columns of X as labels. That feeds nn_summary_table / integration_table
+next to corrected matrices: the metrics measure an Embedding in its own
+coordinates, where a plain matrix of PCs would be z-scored per component
+and re-embedded — flattening exactly the variance ranking the PCs carry.
+
+  mnn_minimal     : batches are merged one at a time into a reference
+                    (largest first). Mutual k-nearest pairs between the
+                    reference and the new batch give correction vectors;
+                    each cell of the new batch moves by the Gaussian-weighted
+                    mean vector of its nearest MNN cells (Haghverdi et al.
+                    2018, fastMNN flavour).
+  harmony_minimal : soft k-means on the cosine-normalized embedding with a
+                    diversity penalty that favours batch-mixed clusters,
+                    then a per-cluster ridge regression of the batch
+                    effect, repeated until the objective settles
+                    (Korsunsky et al. 2019).
+
+Scale: all neighbour queries go through metrics.knn_search (query tiles,
+argpartition, or a KD-tree), so memory is the k-neighbour lists plus one
+tile. MNN time is those queries — exact, so O(N_ref · N_batch · n_pcs)
+per merge with the brute engine; for ~1M cells use algorithm="tree" on a
+few (≲10) PCs. Harmony keeps the cells × clusters assignment matrix R (8·N·K bytes;
+float32 halves it), updates it in vectorized blocks of cells, and works
+on batch-sorted cells so every per-batch reduction is a contiguous slice.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.cluster import KMeans
+
+from .correction import _batch_segments
+from .metrics import Embedding, _values, knn_search, pca2d
+
+
+def _embed(X, n_pcs: int | None, random_state, dtype) -> np.ndarray:
+    """Samples × dims embedding of a features × samples X (a new array)."""
+    if n_pcs is None:
+        return np.array(_values(X).T, dtype=dtype)
+    n_pcs = min(n_pcs, *_values(X).shape)
+    return np.array(pca2d(X, n_components=n_pcs, random_state=random_state, dtype=dtype).coords)
+
+
+def _sample_columns(X):
+    """Sample labels of X (DataFrame columns or an Embedding's), or None."""
+    return X.columns if isinstance(X, (pd.DataFrame, Embedding)) else None
+
+
+def _wrap_embedding(E: np.ndarray, X) -> Embedding:
+    """Corrected samples × dims embedding → dims × samples Embedding, labelled like X."""
+    return Embedding(scores=np.ascontiguousarray(E.T),
+                     index=pd.Index([f"PC{i+1}" for i in range(E.shape[1])]),
+                     columns=_sample_columns(X))
+
+
+def _sample_labels(X, batch) -> np.ndarray:
+    """Batch labels in column order (aligned by label for labelled X)."""
+    columns = _sample_columns(X)
+    if columns is not None and isinstance(batch, pd.Series):
+        return batch.loc[columns].to_numpy()
+    return np.asarray(batch)
+
+
+# --- MNN --------------------------------------------------------------------
+
+def _mnn_pairs(A: np.ndarray, B: np.ndarray, k: int, **knn):
+    """Mutual k-nearest pairs (a, b) between reference A and batch B (row indices)."""
+    ka, kb = min(k, len(A)), min(k, len(B))
+    nn_ba = knn_search(B, A, ka, **knn)[0]                  # each b → its nearest a's
+    # only reference cells that are some b's neighbour can pair: query just those
+    cand, a_cand = np.unique(nn_ba, return_inverse=True)
+    nn_ab = knn_search(A[cand], B, kb, **knn)[0]            # each candidate a → its nearest b's
+    b = np.repeat(np.arange(len(B)), ka)
+    a = nn_ba.ravel()
+    mutual = (nn_ab[a_cand.ravel()] == b[:, None]).any(axis=1)
+    return a[mutual], b[mutual]
+
+
+def _smooth_vectors(B: np.ndarray, anchors: np.ndarray, V: np.ndarray, k: int,
+                    sigma: float | None, **knn) -> np.ndarray:
+    """
+    Correction of every row of B: Gaussian-weighted mean of the vectors V of
+    its k nearest anchor rows (B[anchors]), in tiles of rows.
+    """
+    k = min(k, len(anchors))
+    idx, dist = knn_search(B, B[anchors], k, **knn)
+    if sigma is None:
+        sigma = float(np.median(dist)) or 1.0
+    d2 = np.square(dist)
+    w = np.exp(-(d2 - d2[:, :1]) / (2 * sigma**2))         # shift by the nearest: no underflow
+    w /= w.sum(axis=1, keepdims=True)
+    out = np.empty_like(B)
+    tile = max(1, (1 << 22) // (k * B.shape[1]))
+    for s in range(0, len(B), tile):
+        out[s:s + tile] = np.einsum("ij,ijk->ik", w[s:s + tile], V[idx[s:s + tile]])
+    return out
+
+
+def mnn_minimal(X, batch, n_pcs: int | None = 50, k: int = 20, k_smooth: int | None = None,
+                sigma: float | None = None, order=None, random_state=0, dtype=np.float64,
+                tile_size: int | None = None, algorithm: str = "brute"):
+    """
+    Mutual-nearest-neighbour correction of a PCA embedding (see module notes).
+
+    X        : features × samples (DataFrame or ndarray)
+    batch    : per-sample labels (Series aligned to X.columns, or column order)
+    n_pcs    : embedding dimensions (None: rows of X are the embedding)
+    k        : neighbours searched each way for mutual pairs
+    k_smooth : MNN cells averaged per corrected cell (default k)
+    sigma    : Gaussian kernel width (default: median distance to those cells)
+    order    : batch labels in merge order (default: by decreasing size)
+    tile_size / algorithm : neighbour search, see metrics.knn_search
+
+    Returns: corrected Embedding, n_pcs × samples.
+    """
+    E = _embed(X, n_pcs, random_state, dtype)
+    codes, levels = pd.factorize(_sample_labels(X, batch))
+    if order is None:
+        order = np.argsort(-np.bincount(codes), kind="stable")
+    else:
+        order = [list(levels).index(lvl) for lvl in order]
+    knn = {"tile_size": tile_size, "algorithm": algorithm}
+
+    ref = np.flatnonzero(codes == order[0])
+    for b in order[1:]:
+        new = np.flatnonzero(codes == b)
+        A, B = E[ref], E[new]
+        a, bi = _mnn_pairs(A, B, k, **knn)
+        if len(a) == 0:
+            warnings.warn(f"no mutual nearest neighbours for batch {levels[b]!r}; left uncorrected")
+        else:
+            # mean correction vector of every MNN cell of the new batch
+            anchors, inv = np.unique(bi, return_inverse=True)
+            M = sp.csr_matrix((np.ones(len(bi)), (inv, np.arange(len(bi)))),
+                              shape=(len(anchors), len(bi)))
+            V = np.asarray(M @ (A[a] - B[bi])) / np.asarray(M.sum(axis=1))
+            E[new] = B + _smooth_vectors(B, anchors, V, k_smooth or k, sigma, **knn)
+        ref = np.concatenate([ref, new])
+    return _wrap_embedding(E, X)
+
+
+# --- Harmony ----------------------------------------------------------------
+
+def _normalize_rows(A: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(A, axis=1, keepdims=True)
+    return A / np.where(norm > 0, norm, 1.0)
+
+
+def _assign(Zc: np.ndarray, Y: np.ndarray, sigma: float) -> np.ndarray:
+    """Unnormalized soft assignments exp(−dist/sigma), dist = 2(1 − cos), row-shifted."""
+    L = (2.0 / sigma) * (Zc @ Y.T)
+    L -= L.max(axis=1, keepdims=True)
+    return np.exp(L, out=L)
+
+
+def _harmony_objective(R, Zc, Y, codes, O, E, theta, sigma, tile: int) -> float:
+    """k-means error + sigma·entropy + sigma·diversity penalty, in tiles of cells."""
+    log_ratio = theta * np.log((O + 1) / (E + 1))              # clusters × batches
+    total = 0.0
+    for s in range(0, len(R), tile):
+        Rt = R[s:s + tile]
+        dist = 2.0 * (1.0 - Zc[s:s + tile] @ Y.T)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ent = np.where(Rt > 0, Rt * np.log(Rt), 0.0)
+        total += float((Rt * dist).sum() + sigma * ent.sum()
+                       + sigma * (Rt * log_ratio.T[codes[s:s + tile]]).sum())
+    return total
+
+
+def harmony_minimal(X, batch, n_pcs: int | None = 50, n_clusters: int | None = None,
+                    theta: float = 2.0, sigma: float = 0.1, lamb: float = 1.0,
+                    max_iter: int = 10, max_iter_cluster: int = 20, block_size: float = 0.05,
+                    tol: float = 1e-4, tol_cluster: float = 1e-5, kmeans_sample: int = 100_000,
+                    random_state=0, dtype=np.float64):
+    """
+    Harmony-style correction of a PCA embedding (see module notes).
+
+    X, batch   : as in mnn_minimal; n_pcs as there
+    n_clusters : soft clusters K (default min(100, n_samples / 30))
+    theta      : diversity penalty (0 = plain soft k-means)
+    sigma      : soft-assignment width on cosine distances
+    lamb       : ridge penalty of the per-cluster batch coefficients
+    max_iter / tol                 : outer rounds (clustering + correction)
+    max_iter_cluster / tol_cluster : clustering rounds per outer round
+    block_size : share of cells re-assigned per vectorized block
+    kmeans_sample : cells used to initialize the centroids (k-means)
+
+    Returns: corrected Embedding, n_pcs × samples.
+    """
+    Z = _embed(X, n_pcs, random_state, dtype)
+    labels = _sample_labels(X, batch)
+    N = len(Z)
+    codes, _, order, counts, starts = _batch_segments(pd.Series(labels), pd.RangeIndex(N))
+    codes = codes[order]
+    Z = Z[order]                                              # batch-sorted: segments are slices
+    B = len(counts)
+    K = n_clusters or int(min(100, max(2, round(N / 30))))
+    Pr = counts / N
+    rng = np.random.default_rng(random_state)
+    tile = max(1, (1 << 22) // max(K, Z.shape[1]))
+
+    # initial centroids: k-means on (a sample of) the cosine-normalized cells
+    Zc = _normalize_rows(Z)
+    fit = Zc if N <= kmeans_sample else Zc[rng.choice(N, kmeans_sample, replace=False)]
+    km = KMeans(n_clusters=K, n_init=1, max_iter=25, random_state=random_state).fit(fit)
+    Y = _normalize_rows(km.cluster_centers_.astype(dtype))
+
+    R = np.empty((N, K), dtype=dtype)
+    for s in range(0, N, tile):
+        P = _assign(Zc[s:s + tile], Y, sigma)
+        R[s:s + tile] = P / P.sum(axis=1, keepdims=True)
+
+    def batch_sums(Rb, cb):
+        H = sp.csr_matrix((np.ones(len(cb)), (cb, np.arange(len(cb)))), shape=(B, len(cb)))
+        return np.asarray(H @ Rb).T                           # clusters × batches
+
+    O = np.stack([R[st:st + n].sum(axis=0) for st, n in zip(starts, counts)], axis=1)
+    E = np.outer(R.sum(axis=0), Pr)
+    theta = np.broadcast_to(np.asarray(theta, dtype=float), (B,))
+    n_block = max(1, int(np.ceil(block_size * N)))
+    Z_corr = Z
+    objective = [_harmony_objective(R, Zc, Y, codes, O, E, theta, sigma, tile)]
+
+    for _ in range(max_iter):
+        # 1) clustering: centroid update, then block-wise penalized re-assignment
+        obj_c = objective[-1]
+        for _ in range(max_iter_cluster):
+            Y = _normalize_rows(R.T @ Zc)
+            for idx in np.array_split(rng.permutation(N), max(1, N // n_block)):
+                Rb, cb = R[idx], codes[idx]
+                O -= batch_sums(Rb, cb)
+                E -= np.outer(Rb.sum(axis=0), Pr)
+                P = _assign(Zc[idx], Y, sigma)
+                P *= np.power((E + 1) / (O + 1), theta).T[cb]
+                P /= P.sum(axis=1, keepdims=True)
+                R[idx] = P
+                O += batch_sums(P, cb)
+                E += np.outer(P.sum(axis=0), Pr)
+            new = _harmony_objective(R, Zc, Y, codes, O, E, theta, sigma, tile)
+            done = abs(obj_c - new) < tol_cluster * abs(obj_c)
+            obj_c = new
+            if done:
+                break
+        objective.append(obj_c)
+
+        # 2) correction: per-cluster ridge of Z on [1, batch one-hot], weights R[:, k]
+        #    A_k = Φᵀ diag(R_k) Φ + Λ and Φᵀ diag(R_k) Z, for all k at once
+        A = np.zeros((K, B + 1, B + 1))
+        A[:, 0, 0] = R.sum(axis=0)
+        A[:, 0, 1:] = A[:, 1:, 0] = O
+        A[:, np.arange(1, B + 1), np.arange(1, B + 1)] = O + lamb
+        rhs = np.empty((K, B + 1, Z.shape[1]))
+        for b, (st, n) in enumerate(zip(starts, counts)):
+            rhs[:, b + 1] = R[st:st + n].T @ Z[st:st + n]
+        rhs[:, 0] = rhs[:, 1:].sum(axis=1)
+        W = np.linalg.solve(A, rhs)                              # K × (B+1) × dims
+        Z_corr = Z.copy()
+        for b, (st, n) in enumerate(zip(starts, counts)):
+            Z_corr[st:st + n] -= R[st:st + n] @ W[:, b + 1]
+        Zc = _normalize_rows(Z_corr)
+
+        if abs(objective[-2] - objective[-1]) < tol * abs(objective[-2]):
+            break
+
+    out = np.empty_like(Z_corr)
+    out[order] = Z_corr
+    return _wrap_embedding(out, X)
@@ -0,0 +1,200 @@
+"""
+Integration metrics for batch-correction QC — kBET, iLISI / cLISI, batch
+ASW and graph connectivity.
+
+All of them are computed on one PCA embedding of the z-scored matrix (or
+on a corrected metrics.Embedding as it is) and one kNN graph of that
+embedding (metrics.knn_graph, so the graph is cached and shared with the
+other neighbour metrics):
+
+  kBET acceptance    : fraction of samples whose k-neighbour batch counts
+                       pass a χ² test against the global batch frequencies
+                       (Büttner et al. 2019). ↑ = batches mixed.
+  iLISI / cLISI      : inverse Simpson's index of batch / biology labels
+                       under perplexity-calibrated Gaussian weights on the
+                       3·perplexity nearest neighbours (Korsunsky et al.
+                       2019). iLISI ↑ (up to n_batches), cLISI ↓ (to 1).
+  Batch ASW          : mean 1 − |silhouette| of batch labels, within each
+                       biology group when given. ↑ = batches mixed.
+  Graph connectivity : mean fraction of each biology group in the largest
+                       connected component of its induced kNN subgraph. ↑.
+
+Every score is vectorized over samples; per-sample work runs in row tiles,
+so memory is the n × k graph plus one tile, and all scores but the
+silhouette are O(N·k). The cost at scale is the kNN query — O(N²·n_pcs)
+with the default brute engine, much less with algorithm="tree" on a few
+(≲5) PCs — and the silhouette, O(N²) unless `asw_sample_size` is set.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+from scipy.stats import chi2
+from sklearn.metrics import silhouette_samples
+
+from .metrics import Embedding, _values, knn_graph, pca2d
+
+
+def _label_counts(nn_idx: np.ndarray, codes: np.ndarray, n_levels: int, weights=None) -> np.ndarray:
+    """Per-row (optionally weighted) label counts of the neighbours: rows × levels."""
+    n = nn_idx.shape[0]
+    flat = (np.arange(n)[:, None] * n_levels + codes[nn_idx]).ravel()
+    w = None if weights is None else weights.ravel()
+    return np.bincount(flat, weights=w, minlength=n * n_levels).reshape(n, n_levels)
+
+
+def kbet_acceptance(nn_idx: np.ndarray, batch, alpha: float = 0.05) -> float:
+    """
+    kBET acceptance rate: share of samples whose neighbour batch composition
+    is not rejected (χ² test, level `alpha`) against the global composition.
+    """
+    codes, levels = pd.factorize(np.asarray(batch))
+    B = len(levels)
+    if B < 2:
+        return 1.0
+    n, k = nn_idx.shape
+    expected = k * np.bincount(codes, minlength=B) / n
+    observed = _label_counts(nn_idx, codes, B)
+    stat = (np.square(observed - expected) / expected).sum(axis=1)
+    return float((chi2.sf(stat, df=B - 1) >= alpha).mean())
+
+
+def _perplexity_weights(D: np.ndarray, perplexity: float, tol: float = 1e-5, max_iter: int = 50):
+    """
+    Row-normalized Gaussian weights exp(−beta·D), with each row's beta found
+    by bisection so the weights' entropy is log(perplexity) — all rows at once.
+    D is shifted by its row minimum, which leaves the normalized weights
+    unchanged and avoids underflow.
+    """
+    D = D - D.min(axis=1, keepdims=True)
+    log_u = np.log(perplexity)
+    beta = np.ones(D.shape[0])
+    lo = np.full_like(beta, -np.inf)
+    hi = np.full_like(beta, np.inf)
+    for _ in range(max_iter):
+        P = np.exp(-D * beta[:, None])
+        sum_p = P.sum(axis=1)
+        H = np.log(sum_p) + beta * (D * P).sum(axis=1) / sum_p
+        diff = H - log_u
+        up = diff > tol                      # too flat → sharpen
+        down = diff < -tol                   # too peaked → flatten
+        if not (up.any() or down.any()):
+            break
+        lo[up] = beta[up]
+        beta[up] = np.where(np.isinf(hi[up]), beta[up] * 2, (beta[up] + hi[up]) / 2)
+        hi[down] = beta[down]
+        beta[down] = np.where(np.isinf(lo[down]), beta[down] / 2, (beta[down] + lo[down]) / 2)
+    P = np.exp(-D * beta[:, None])
+    return P / P.sum(axis=1, keepdims=True)
+
+
+def lisi(E: np.ndarray, nn_idx: np.ndarray, labels: list, perplexity: float = 30,
+         tile_size: int | None = None) -> list:
+    """
+    Mean LISI (inverse Simpson's index) of each label array in `labels`, on
+    embedding E (samples × dims) over the neighbour lists nn_idx. The
+    weights are computed once per tile and shared by all label arrays.
+    """
+    n, k = nn_idx.shape
+    codes = [pd.factorize(np.asarray(lab)) for lab in labels]
+    totals = np.zeros(len(labels))
+    tile = tile_size or max(1, (1 << 22) // (k * E.shape[1]))
+    for s in range(0, n, tile):
+        e = min(s + tile, n)
+        idx = nn_idx[s:e]
+        D = np.sqrt(np.square(E[idx] - E[s:e, None, :]).sum(axis=2))
+        P = _perplexity_weights(D, perplexity)
+        for j, (c, levels) in enumerate(codes):
+            W = _label_counts(idx, c, len(levels), weights=P)
+            totals[j] += (1.0 / np.square(W).sum(axis=1)).sum()
+    return [float(v) for v in totals / n]
+
+
+def batch_asw(E: np.ndarray, batch, group=None, sample_size: int | None = None,
+              random_state=0) -> float:
+    """
+    Batch silhouette: mean over biology groups (all samples if group is None)
+    of mean(1 − |s|), s = silhouette of the batch labels on E. Groups with a
+    single batch are skipped. `sample_size` scores a random subset.
+    """
+    n = E.shape[0]
+    rows = np.arange(n)
+    if sample_size is not None and sample_size < n:
+        rows = np.sort(np.random.default_rng(random_state).choice(n, sample_size, replace=False))
+    b = np.asarray(batch)[rows]
+    g = np.zeros(len(rows)) if group is None else np.asarray(group)[rows]
+    scores = []
+    for val in pd.unique(g):
+        sub = g == val
+        n_b = len(pd.unique(b[sub]))
+        if n_b < 2 or n_b >= sub.sum():
+            continue
+        s = silhouette_samples(E[rows[sub]], b[sub])
+        scores.append(np.mean(1.0 - np.abs(s)))
+    return float(np.mean(scores)) if scores else float("nan")
+
+
+def graph_connectivity(nn_idx: np.ndarray, group=None) -> float:
+    """
+    Mean over biology groups (one group if None) of the fraction of the group
+    in the largest weakly connected component of its induced kNN subgraph.
+    """
+    n, k = nn_idx.shape
+    A = sp.csr_matrix((np.ones(n * k), nn_idx.ravel(), np.arange(0, n * k + 1, k)), shape=(n, n))
+    g = np.zeros(n) if group is None else np.asarray(group)
+    fractions = []
+    for val in pd.unique(g):
+        idx = np.flatnonzero(g == val)
+        _, comp = connected_components(A[idx][:, idx], directed=True, connection="weak")
+        fractions.append(np.bincount(comp).max() / len(idx))
+    return float(np.mean(fractions))
+
+
+def integration_metrics(X, batch, group=None, n_pcs: int = 50, k: int = 15,
+                        perplexity: float = 30, alpha: float = 0.05,
+                        asw_sample_size: int | None = None, random_state=0,
+                        dtype=np.float64, tile_size: int | None = None,
+                        algorithm: str = "brute") -> dict:
+    """
+    All integration metrics of one features×samples matrix, from one PCA
+    embedding (n_pcs components of the z-scored features) and one kNN graph
+    with max(k, 3·perplexity) neighbours: kBET and graph connectivity use the
+    first k, LISI all of them. cLISI needs `group`. An Embedding (e.g. from
+    mnn_minimal) is that embedding already: its first n_pcs dimensions are
+    used as they are.
+    Returns: dict column → score, in integration_table order.
+    """
+    n_samples = _values(X).shape[1]
+    n_pcs = min(n_pcs, *_values(X).shape)
+    if isinstance(X, Embedding):
+        E = np.asarray(X.scores[:n_pcs].T, dtype=dtype)   # already an embedding: no re-PCA
+    else:
+        E, _ = pca2d(X, n_components=n_pcs, random_state=random_state, dtype=dtype)
+    kk = min(max(k, int(3 * perplexity)), n_samples - 1)
+    nn_idx = knn_graph(E.T, kk, dtype=dtype, tile_size=tile_size, algorithm=algorithm)
+
+    labels = [batch] if group is None else [batch, group]
+    lisis = lisi(E, nn_idx, labels, perplexity=perplexity, tile_size=tile_size)
+    scores = {"kBET acceptance": kbet_acceptance(nn_idx[:, :k], batch, alpha=alpha),
+              "iLISI": lisis[0]}
+    if group is not None:
+        scores["cLISI"] = lisis[1]
+    scores["Batch ASW"] = batch_asw(E, batch, group, sample_size=asw_sample_size,
+                                    random_state=random_state)
+    scores["Graph connectivity"] = graph_connectivity(nn_idx[:, :k], group)
+    return scores
+
+
+def integration_table(mats, batch, group=None, **kwargs) -> pd.DataFrame:
+    """
+    mats: list of (name, Xmatrix) pairs
+    Returns a DataFrame (index Condition, one column per metric) in the
+    nn_summary_table layout. kwargs: see integration_metrics.
+    """
+    rows = []
+    for name, Xmat in mats:
+        row = {"Condition": name}
+        row.update(integration_metrics(Xmat, batch, group, **kwargs))
+        rows.append(row)
+    df = pd.DataFrame(rows).set_index("Condition")
+    return df.round(3)
@@ -0,0 +1,125 @@
+"""
+Low-rank batch correction in PCA space, reconstructed lazily.
+
+For wide profiles (e.g. 20k features) most batch structure sits in the top
+components. Instead of correcting every feature, the low-rank mode works on
+the standardized matrix Z = (X − mu) / sd and its truncated SVD basis U
+(features × rank, randomized SVD):
+
+    Z = U·T + E,       T = Uᵀ·Z   (rank × samples scores), Uᵀ·E = 0
+
+Batch Align then runs on the scores T, treating components as features
+(same function, same design handling), giving T'. The corrected
+matrix is never formed; `LowRankCorrection` keeps
+
+    X_adj = X + sd·U·(T' − T)          (low-rank correction + untouched residual)
+
+and materializes only the features / samples a caller asks for. The
+residual E is left as it is, so batch effects outside the top `rank`
+components are not corrected.
+
+method="combat" gives the same per-component location/scale fit, without
+ComBat's EB step. Its priors pool features on the premise that they are
+exchangeable; components are not — a batch effect concentrates in one or
+two of them, so the pooled prior mean of gamma is far from zero, and
+shrinking every other component toward it shifts batches apart along
+components that had no batch effect at all.
+
+pca2d, knn_graph and the nn_consistency metrics accept a LowRankCorrection
+and run on its corrected scores (rank × samples) directly: U is orthonormal,
+so distances between samples in the corrected low-rank part are distances
+between score columns.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sklearn.utils.extmath import randomized_svd
+
+from .correction import _guard_var, _nan_row_stats, batch_align_minimal
+
+
+@dataclass
+class LowRankCorrection:
+    """
+    Lazy low-rank-plus-residual batch correction (see module notes).
+
+    X          : the uncorrected features × samples values (referenced, not copied)
+    mu, sd     : per-feature standardization
+    basis      : features × rank orthonormal basis U
+    scores     : rank × samples corrected scores T'
+    delta      : rank × samples correction T' − T
+    residual_ss: sum of squares of the standardized residual E
+    index, columns : labels of X when it was a DataFrame, else None
+    """
+    X: np.ndarray
+    mu: np.ndarray
+    sd: np.ndarray
+    basis: np.ndarray
+    scores: np.ndarray
+    delta: np.ndarray
+    residual_ss: float
+    index: pd.Index | None = None
+    columns: pd.Index | None = None
+
+    @property
+    def shape(self):
+        return self.X.shape
+
+    def materialize(self, features=None, samples=None) -> np.ndarray:
+        """
+        Corrected values for the selected feature rows / sample columns
+        (index arrays, slices or None). Costs O(|features| · |samples| · rank).
+        """
+        rows = slice(None) if features is None else features
+        cols = slice(None) if samples is None else samples
+        Xs = np.array(self.X[rows][:, cols], dtype=float)
+        Xs += self.sd[rows, None] * (self.basis[rows] @ self.delta[:, cols])
+        return Xs
+
+    def to_frame(self) -> pd.DataFrame:
+        """The full corrected matrix as a DataFrame (labels of X if it had them)."""
+        return pd.DataFrame(self.materialize(), index=self.index, columns=self.columns)
+
+
+def correct_lowrank(X, batch, design=None, method: str = "combat", rank: int | None = None,
+                    random_state=0, **kwargs) -> LowRankCorrection:
+    """
+    Entry point used by batch_align_minimal / combat_minimal for
+    output="lowrank": correct the top `rank` SVD scores of the standardized X.
+
+    X      : dense features × samples (DataFrame or ndarray); NaNs count as
+             the feature mean in the basis and scores, and stay NaN when
+             materialized
+    rank   : components kept (default min(200, n_features, n_samples − 1))
+    method : "align" or "combat"; both fit a plain per-component
+             location/scale (no EB shrinkage, see module notes)
+    random_state : seed of the randomized SVD (None → 0)
+    kwargs : options of batch_align_minimal run on the scores (robust, trim)
+    """
+    if method not in ("align", "combat"):
+        raise ValueError(f"unknown method {method!r}; expected 'align' or 'combat'")
+    index = columns = None
+    if isinstance(X, pd.DataFrame):
+        index, columns = X.index, X.columns
+        batch = pd.Series(batch).loc[columns].to_numpy()
+        if isinstance(design, pd.DataFrame):
+            design = design.loc[columns]
+        Xv = X.to_numpy()
+    else:
+        Xv = np.asarray(X)
+    G, N = Xv.shape
+    rank = min(rank or 200, G, N - 1)
+
+    mu, sd = _nan_row_stats(np.asarray(Xv, dtype=np.float64))
+    sd = _guard_var(sd)
+    Z = (Xv - mu[:, None]) / sd[:, None]
+    np.nan_to_num(Z, copy=False)
+    U, S, Vt = randomized_svd(Z, rank, random_state=0 if random_state is None else random_state)
+    T = S[:, None] * Vt                                   # = Uᵀ·Z
+    residual_ss = max(float(np.square(Z).sum() - np.square(S).sum()), 0.0)
+    del Z
+
+    T_adj = batch_align_minimal(T, batch, design, **kwargs)
+    return LowRankCorrection(X=Xv, mu=mu, sd=sd, basis=U, scores=T_adj, delta=T_adj - T,
+                             residual_ss=residual_ss, index=index, columns=columns)
@@ -0,0 +1,467 @@
+"""
+Evaluation of batch corrections — PCA projection and nearest-neighbour
+label consistency.
+
+Importable home of the metrics used in the BioUnfold #5 notebooks. All
+functions take a features × samples matrix (DataFrame or ndarray) and
+per-sample labels in column order. A lowrank.LowRankCorrection or an
+Embedding (the output of biounfold.embedding) is scored on its scores as
+they are — never z-scored per dimension — so tables can mix them with
+corrected matrices.
+
+Precision
+---------
+Every function takes `dtype` (default float64). With dtype=np.float32 the
+standardized matrix, the PCA and the distance matrix are float32 — half the
+memory and bandwidth — while the sensitive reductions still accumulate in
+float64: per-feature means/variances, and squared distances (scikit-learn
+upcasts float32 blocks for the ‖a‖² + ‖b‖² − 2a·b expansion). Against the
+float64 result, with u = 2**-24:
+
+  - z-scores carry two roundings: |Δz| ≤ 2u·|z|;
+  - distances: |Δd| ≤ ~3u·d, so a neighbour can only change where two
+    candidate distances are within that gap of each other (near-ties); each
+    swap moves nn_consistency by at most 1 / (n_samples · k);
+  - pca2d: coordinates and explained-variance ratios agree to
+    O(u · ‖X‖² / (λ2 − λ3)); with a clear PC2/PC3 gap that is ~1e-6.
+
+Neighbours
+----------
+`knn_indices` never builds the N×N distance matrix: query samples go in
+tiles of `tile_size` rows, each tile's distances to all samples are reduced
+to its k nearest with `argpartition` (O(N) per row) and only those k are
+sorted. Memory is a few tile_size × N arrays (distances, partition
+indices) instead of N × N, time O(N² d + N k log k).
+For low-dimensional embeddings (a few PCs) algorithm="tree" uses a KD-tree
+instead. Both are exact, so the metrics equal the full-argsort ones (up to
+the order of exactly tied distances).
+
+`knn_graph` caches the neighbour lists per matrix (keyed by a fingerprint of
+its values) and k: every label scored on the same matrix — batch, biology,
+extra annotation columns — reuses one query, and a cached graph for a larger
+k serves any smaller k (rows are sorted by distance). The same sorting gives
+consistency curves over k = 1..kmax from one kmax query (`nn_consistency_curve`).
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import PCA, IncrementalPCA
+from sklearn.metrics import pairwise_distances
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import StandardScaler
+
+from .lowrank import LowRankCorrection
+from .streaming import _merge_moments, _open_input
+
+
+def _values(X) -> np.ndarray:
+    if isinstance(X, (LowRankCorrection, Embedding)):
+        return X.scores                      # metrics run on the (corrected) scores
+    return X.to_numpy() if isinstance(X, pd.DataFrame) else np.asarray(X)
+
+
+# kNN graphs keyed by matrix fingerprint and query options (small LRU; n × k each)
+_KNN_CACHE = OrderedDict()
+_KNN_CACHE_SIZE = 16
+
+
+def _fingerprint(X) -> tuple:
+    """Shape, dtype and content hash of a matrix (changes if X is modified in place)."""
+    Xv = np.ascontiguousarray(_values(X))
+    return Xv.shape, Xv.dtype.str, hashlib.blake2b(Xv.tobytes(), digest_size=16).hexdigest()
+
+
+def _zscore_rows(X, dtype=np.float64) -> np.ndarray:
+    """
+    Per-feature z-scores (ddof=1, zero sd → 1) as a new `dtype` array.
+    Moments are accumulated and the shift/scale applied in float64; only
+    the result is rounded to `dtype`.
+    """
+    if isinstance(X, (LowRankCorrection, Embedding)):
+        return X.scores.astype(dtype)        # scores of standardized data: already comparable
+    Xv = _values(X)
+    mu = Xv.mean(axis=1, dtype=np.float64)[:, None]
+    sd = Xv.std(axis=1, ddof=1, dtype=np.float64)
+    sd = np.where(sd == 0, 1.0, sd)[:, None]
+    Xz = np.empty(Xv.shape, dtype=dtype)
+    np.subtract(Xv, mu, out=Xz, casting="same_kind")
+    np.divide(Xz, sd, out=Xz, casting="same_kind")
+    return Xz
+
+
+@dataclass
+class PCAResult:
+    """
+    pca2d output. Unpacks as the (coords, var_sum) pair pca2d always returned.
+
+    coords   : (n_samples, n_components) PC coordinates
+    var_sum  : sum of explained variance ratio for PC1+PC2
+    backend  : solver that produced it
+    explained_variance_ratio : per component
+    exact_var_sum : PC1+PC2 ratio from the exact solver (check_exact=True), else None
+    """
+    coords: np.ndarray
+    var_sum: float
+    backend: str
+    explained_variance_ratio: np.ndarray
+    exact_var_sum: float | None = None
+
+    def __iter__(self):
+        return iter((self.coords, self.var_sum))
+
+
+@dataclass
+class Embedding:
+    """
+    A corrected embedding (biounfold.embedding output), dims × samples.
+
+    Its coordinates are the space distances are meant to be measured in, so
+    the metrics use them as they are: no per-dimension z-scoring (which would
+    give every PC unit variance) and no second PCA.
+
+    scores : dims × samples coordinates
+    index, columns : dimension names (PC1..) and sample labels, or None
+    """
+    scores: np.ndarray
+    index: pd.Index | None = None
+    columns: pd.Index | None = None
+
+    @property
+    def shape(self):
+        return self.scores.shape
+
+    def to_frame(self) -> pd.DataFrame:
+        """The embedding as a DataFrame (dims × samples)."""
+        return pd.DataFrame(self.scores, index=self.index, columns=self.columns)
+
+
+def _flip_signs(coords: np.ndarray, loadings_max: np.ndarray):
+    """Sign convention of scikit-learn's svd_flip: largest |loading| positive."""
+    coords *= np.where(loadings_max < 0, -1.0, 1.0)
+
+
+def _pca_gram(X, n_components: int, dtype, chunk_size: int | None):
+    """
+    PCA through the samples × samples Gram matrix of the z-scored data,
+    accumulated (float64) over feature blocks: O(n² p) time, n² memory.
+    """
+    Xv = _values(X)
+    p, n = Xv.shape
+    chunk = chunk_size or max(1, (1 << 22) // n)
+    blocks = [(s, min(s + chunk, p)) for s in range(0, p, chunk)]
+
+    def z_block(s, e):
+        Zb = np.asarray(Xv[s:e], dtype=np.float64)
+        sd = Zb.std(axis=1)
+        sd[sd == 0] = 1.0                                      # as StandardScaler
+        return ((Zb - Zb.mean(axis=1, keepdims=True)) / sd[:, None]).astype(dtype, copy=False)
+
+    K = np.zeros((n, n))
+    for s, e in blocks:
+        Zb = z_block(s, e)
+        K += Zb.T @ Zb
+    w, U = np.linalg.eigh(K)
+    w, U = w[::-1][:n_components], U[:, ::-1][:, :n_components]
+    coords = U * np.sqrt(np.maximum(w, 0.0))
+
+    # loadings V·s = Zᵀ U, one more block pass, only to fix the signs
+    best = np.zeros(n_components)
+    for s, e in blocks:
+        L = z_block(s, e) @ U
+        j = np.abs(L).argmax(axis=0)
+        m = L[j, np.arange(n_components)]
+        upd = np.abs(m) > np.abs(best)
+        best[upd] = m[upd]
+    _flip_signs(coords, best)
+    return coords, w / np.trace(K)
+
+
+def _pca_incremental(X, n_components: int, dtype, chunk_size: int | None):
+    """
+    IncrementalPCA over chunks of samples (columns) of X — an ndarray,
+    np.memmap or `.npy` path: one pass for the feature moments, one
+    partial_fit pass and one transform pass. Memory is one chunk.
+    """
+    Xv = _open_input(X) if isinstance(X, (str, os.PathLike)) else _values(X)
+    p, n = Xv.shape
+    chunk = max(n_components, chunk_size or (1 << 22) // p)
+    bounds = list(range(0, n, chunk)) + [n]
+    if len(bounds) > 2 and bounds[-1] - bounds[-2] < n_components:
+        del bounds[-2]                                         # no chunk smaller than n_components
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+
+    zeros = np.zeros(p)
+    acc = (0, zeros, zeros)
+    for s, e in chunks:
+        acc = _merge_moments(acc, np.asarray(Xv[:, s:e], dtype=np.float64).T)
+    mu = acc[1]
+    sd = np.sqrt(acc[2] / n)
+    sd[sd == 0] = 1.0
+
+    def z_chunk(s, e):
+        return ((np.asarray(Xv[:, s:e], dtype=np.float64).T - mu) / sd).astype(dtype, copy=False)
+
+    ipca = IncrementalPCA(n_components=n_components)
+    for s, e in chunks:
+        ipca.partial_fit(z_chunk(s, e))
+    coords = np.empty((n, n_components), dtype=dtype)
+    for s, e in chunks:
+        coords[s:e] = ipca.transform(z_chunk(s, e))
+    return coords, ipca.explained_variance_ratio_
+
+
+def _pca_scores(L, n_components: int, random_state, dtype) -> PCAResult:
+    """
+    PCA of the rank × samples scores of a LowRankCorrection (ratios include
+    its residual variance) or of an Embedding, centred but not scaled.
+    """
+    T = np.asarray(L.scores.T, dtype=dtype)                     # samples × rank
+    n_components = min(n_components, *T.shape)
+    pca = PCA(n_components=n_components, svd_solver="full", random_state=random_state)
+    coords = pca.fit_transform(T)
+    total = pca.explained_variance_.sum() / pca.explained_variance_ratio_.sum()
+    if isinstance(L, LowRankCorrection):
+        total += L.residual_ss / (T.shape[0] - 1)
+    ratio = pca.explained_variance_ / total
+    backend = "lowrank" if isinstance(L, LowRankCorrection) else "embedding"
+    return PCAResult(coords, float(np.sum(ratio[:2], dtype=np.float64)), backend, ratio)
+
+
+def pca2d(X, n_components: int = 2, random_state: int = 42, dtype=np.float64,
+          backend: str = "auto", chunk_size: int | None = None,
+          check_exact: bool = False) -> PCAResult:
+    """
+    Fit a 2D PCA on samples (columns) of a features×samples matrix X.
+    Returns: PCAResult, unpacking as
+      coords : (n_samples, 2) array of PC coordinates
+      var_sum : float, sum of explained variance ratio for PC1+PC2
+    Notes:
+      - Features are standardized (z-scored) across samples before PCA.
+      - X must be features (rows) × samples (cols).
+      - dtype=np.float32 runs the SVD in float32 (see module notes).
+
+    backend :
+      "auto"        scikit-learn PCA, solver chosen by size (as before)
+      "full"        exact LAPACK SVD
+      "randomized"  randomized truncated SVD (Halko et al.) — a few passes
+                    over the data for the top components
+      "incremental" IncrementalPCA over sample chunks of `chunk_size`
+                    columns; X may be a `.npy` path or memmap, never loaded
+                    whole. Approximate: each partial fit truncates to
+                    n_components, so PC2 drifts with small chunks
+      "gram"        eigendecomposition of the samples × samples Gram matrix,
+                    accumulated over `chunk_size` feature rows — for
+                    n_samples ≪ n_features
+    All backends follow scikit-learn's sign convention, so coordinates are
+    comparable across them. check_exact=True also runs "full" and records
+    its PC1+PC2 ratio as `exact_var_sum` (loads X whole).
+
+    X may be a lowrank.LowRankCorrection: the PCA then runs on its corrected
+    scores, already in standardized units (no z-scoring), and the ratios are
+    of the whole corrected matrix, residual variance included. An Embedding
+    is rotated the same way, without z-scoring its dimensions.
+    """
+    if isinstance(X, (LowRankCorrection, Embedding)):
+        return _pca_scores(X, n_components, random_state, dtype)
+    if backend == "gram":
+        coords, ratio = _pca_gram(X, n_components, dtype, chunk_size)
+    elif backend == "incremental":
+        coords, ratio = _pca_incremental(X, n_components, dtype, chunk_size)
+    elif backend in ("auto", "full", "randomized"):
+        scaler = StandardScaler(with_mean=True, with_std=True)
+        Xz = scaler.fit_transform(np.asarray(_values(X).T, dtype=dtype))   # samples × features
+        pca = PCA(n_components=n_components, svd_solver=backend, random_state=random_state)
+        coords = pca.fit_transform(Xz)
+        ratio = pca.explained_variance_ratio_
+    else:
+        raise ValueError(f"unknown backend {backend!r}; expected 'auto', 'full', "
+                         "'randomized', 'incremental' or 'gram'")
+
+    var_sum = float(np.sum(ratio[:2], dtype=np.float64))
+    result = PCAResult(coords, var_sum, backend, np.asarray(ratio))
+    if check_exact:
+        Xe = _open_input(X) if isinstance(X, (str, os.PathLike)) else X
+        result.exact_var_sum = pca2d(Xe, n_components=2, dtype=dtype, backend="full").var_sum
+    return result
+
+
+def knn_search(Q: np.ndarray, R: np.ndarray, k: int, tile_size: int | None = None,
+               algorithm: str = "brute", exclude_self: bool = False):
+    """
+    k nearest reference rows of every query row (Euclidean), in query tiles.
+    Q, R are samples × dims arrays; exclude_self=True when Q is R (a sample
+    is then not its own neighbour). Shared by the metrics and the embedding
+    corrections (biounfold.embedding).
+
+    Returns: idx, dist — (n_query, k), each row sorted by increasing distance.
+    """
+    n = R.shape[0]
+    if not 0 < k <= n - exclude_self:
+        raise ValueError(f"k must be in [1, {n - exclude_self}], got {k}")
+    if algorithm == "tree":
+        nn = NearestNeighbors(n_neighbors=k, algorithm="kd_tree").fit(R)
+        dist, idx = nn.kneighbors() if exclude_self else nn.kneighbors(Q)   # query = fit set: self excluded
+        return idx, dist
+    if algorithm != "brute":
+        raise ValueError(f"unknown algorithm {algorithm!r}; expected 'brute' or 'tree'")
+
+    m = Q.shape[0]
+    tile = tile_size or max(1, (1 << 23) // n)
+    nn_idx = np.empty((m, k), dtype=np.intp)
+    nn_dist = np.empty((m, k), dtype=np.result_type(Q.dtype, R.dtype, np.float32))
+    for s in range(0, m, tile):
+        e = min(s + tile, m)
+        D = pairwise_distances(Q[s:e], R, metric="euclidean")
+        if exclude_self:
+            D[np.arange(e - s), np.arange(s, e)] = np.inf
+        idx = np.argpartition(D, k - 1, axis=1)[:, :k] if k < n else np.tile(np.arange(n), (e - s, 1))
+        d = np.take_along_axis(D, idx, axis=1)
+        srt = np.argsort(d, axis=1, kind="stable")
+        nn_idx[s:e] = np.take_along_axis(idx, srt, axis=1)
+        nn_dist[s:e] = np.take_along_axis(d, srt, axis=1)
+    return nn_idx, nn_dist
+
+
+def knn_indices(X, k: int, tile_size: int | None = None, algorithm: str = "brute",
+                dtype=np.float64) -> np.ndarray:
+    """
+    Indices of the k nearest samples (Euclidean, self excluded) of every sample
+    (column) of a features×samples matrix X.
+
+    tile_size : query samples per tile for algorithm="brute" (default:
+                ~64 MB of distances per tile)
+    algorithm : "brute" (tiled exact distances) or "tree" (KD-tree; worthwhile
+                for a handful of dimensions, e.g. PCA scores)
+
+    Returns: (n_samples, k) int array, each row sorted by increasing distance.
+    """
+    Y = np.asarray(_values(X).T, dtype=dtype)            # samples × features
+    return knn_search(Y, Y, k, tile_size=tile_size, algorithm=algorithm, exclude_self=True)[0]
+
+
+def knn_graph(X, k: int, zscore: bool = False, dtype=np.float64,
+              tile_size: int | None = None, algorithm: str = "brute") -> np.ndarray:
+    """
+    knn_indices of X (after per-feature z-scoring if `zscore`), computed once
+    per matrix and cached. A cached graph for the same matrix and options with
+    k' ≥ k is sliced instead of recomputed. The returned array is read-only.
+    """
+    scored = isinstance(X, (LowRankCorrection, Embedding))   # used as they are, see _zscore_rows
+    base = (_fingerprint(X), bool(zscore) and not scored, np.dtype(dtype).str, algorithm)
+    for (b, kc), nn_idx in reversed(_KNN_CACHE.items()):
+        if b == base and kc >= k:
+            _KNN_CACHE.move_to_end((b, kc))
+            return nn_idx[:, :k]
+
+    Y = _zscore_rows(X, dtype) if zscore else X
+    nn_idx = knn_indices(Y, k, tile_size=tile_size, algorithm=algorithm, dtype=dtype)
+    nn_idx.flags.writeable = False
+    _KNN_CACHE[(base, k)] = nn_idx
+    if len(_KNN_CACHE) > _KNN_CACHE_SIZE:
+        _KNN_CACHE.popitem(last=False)
+    return nn_idx
+
+
+def _label_agreement(nn_idx: np.ndarray, labels) -> float:
+    """Mean fraction of neighbours (rows of nn_idx) sharing the sample's label."""
+    lab = np.asarray(labels)
+    same = (lab[nn_idx] == lab[:, None]).astype(float)
+    return float(same.mean())
+
+
+def _agreement_curve(nn_idx: np.ndarray, labels) -> np.ndarray:
+    """
+    Label agreement for every k = 1..nn_idx.shape[1] at once: cumulative
+    same-label counts along the distance-sorted neighbour lists.
+    """
+    lab = np.asarray(labels)
+    same = lab[nn_idx] == lab[:, None]
+    hits = same.sum(axis=0, dtype=np.int64).cumsum()   # same-label pairs within the first k
+    return hits / (len(lab) * np.arange(1, nn_idx.shape[1] + 1))
+
+
+def nn_consistency(X, labels, k: int = 5, dtype=np.float64,
+                   tile_size: int | None = None, algorithm: str = "brute") -> float:
+    """
+    Mean fraction of k nearest neighbours sharing the same label.
+    Operates on samples (columns) of a features×samples matrix X.
+    tile_size / algorithm: see knn_indices; the graph is cached (knn_graph).
+    """
+    nn_idx = knn_graph(X, k, dtype=dtype, tile_size=tile_size, algorithm=algorithm)
+    return _label_agreement(nn_idx, labels)
+
+
+def nn_consistency_zscored(X, labels, k: int = 5, dtype=np.float64,
+                           tile_size: int | None = None, algorithm: str = "brute") -> float:
+    """
+    NN consistency computed after global per-feature z-scoring.
+    (Removes scale effects from de-standardization.)
+    """
+    nn_idx = knn_graph(X, k, zscore=True, dtype=dtype, tile_size=tile_size, algorithm=algorithm)
+    return _label_agreement(nn_idx, labels)
+
+
+def nn_consistency_curve(X, labels, kmax: int = 200, zscore: bool = True,
+                         dtype=np.float64) -> np.ndarray:
+    """
+    nn_consistency (z-scored by default) for every k = 1..kmax from a single
+    kmax-neighbour query; kmax is capped at n_samples - 1.
+    Returns: array of length kmax, entry k-1 = consistency at k.
+    """
+    kmax = min(kmax, _values(X).shape[1] - 1)
+    return _agreement_curve(knn_graph(X, kmax, zscore=zscore, dtype=dtype), labels)
+
+
+def _score_labels(batch, group, annotations) -> dict:
+    """Column name → per-sample labels, in nn_summary_table order."""
+    labels = {"Batch NN (z)": batch}
+    if group is not None:
+        labels["Biology NN (z)"] = group
+    if annotations is not None:
+        labels.update({f"{col} NN (z)": annotations[col] for col in annotations.columns})
+    return labels
+
+
+def nn_summary_table(mats, batch, group=None, k: int = 5, dtype=np.float64,
+                     annotations: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    mats: list of (name, Xmatrix) pairs
+    Returns a tidy DataFrame with NN consistency for batch (and biology,
+    when `group` is given, and "<column> NN (z)" for every column of
+    `annotations`, samples × labels in column order). One cached kNN graph
+    per matrix serves all label columns.
+    """
+    labels = _score_labels(batch, group, annotations)
+    rows = []
+    for name, Xmat in mats:
+        nn_idx = knn_graph(Xmat, k, zscore=True, dtype=dtype)
+        row = {"Condition": name}
+        row.update({col: _label_agreement(nn_idx, lab) for col, lab in labels.items()})
+        rows.append(row)
+    df = pd.DataFrame(rows).set_index("Condition")
+    return df.round(3)
+
+
+def nn_curve_table(mats, batch, group=None, kmax: int = 200, dtype=np.float64,
+                   annotations: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    nn_summary_table over k = 1..kmax: one kmax query per matrix, every k and
+    label from cumulative sums of the same graph.
+    Returns a tidy DataFrame with columns Condition, k and one column per
+    label (as in nn_summary_table); its rows at k=5 equal
+    nn_summary_table(..., k=5) before rounding.
+    """
+    labels = _score_labels(batch, group, annotations)
+    frames = []
+    for name, Xmat in mats:
+        km = min(kmax, _values(Xmat).shape[1] - 1)
+        nn_idx = knn_graph(Xmat, km, zscore=True, dtype=dtype)
+        df = pd.DataFrame({col: _agreement_curve(nn_idx, lab) for col, lab in labels.items()})
+        df.insert(0, "k", np.arange(1, km + 1))
+        df.insert(0, "Condition", name)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
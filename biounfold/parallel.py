@@ -0,0 +1,139 @@
+"""
+Process-parallel, feature-sharded ComBat.
+
+After standardization, ComBat is independent across features except for the
+per-batch EB hyperparameters, which are means/variances *across* features.
+`combat_parallel` therefore runs in two sharded phases:
+
+  1. workers compute per-feature moments (mu, sd, gamma_hat, delta_hat,
+     sigma2_g) for their rows; the parent estimates the priors and the EB
+     posterior from the gathered features × batches estimates;
+  2. workers apply the EB posterior to their rows, writing the output.
+
+Both phases run combat_minimal's own block kernels on rows in column order,
+and every step is per row, so the output is bit-identical to combat_minimal
+(design=None) for any n_jobs / shard_size.
+
+Input and output matrices live in `multiprocessing.shared_memory`, so only
+row ranges and small per-feature arrays cross process boundaries. Each worker
+caps its BLAS/OpenMP pools (threadpoolctl) so n_jobs × threads stays within
+the machine; with n_jobs=1 the cap applies in-process for the duration of
+the call only. Input must be finite; for missing values use combat_minimal.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from .correction import (_batch_segments, _combat_block_apply, _combat_block_moments,
+                         _combat_eb, _guard_var, _standardize_block)
+
+# Per-process view of the shared buffers and batch layout (set by _init_worker)
+_SHARED = {}
+
+
+def _init_worker(specs, layout, blas_threads):
+    threadpool_limits(limits=blas_threads)           # pool processes only
+    _attach(specs, layout)
+
+
+def _attach(specs, layout):
+    _SHARED.clear()
+    for key, (name, shape) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _SHARED[key] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+    _SHARED["layout"] = layout
+
+
+def _shard_moments(s: int, e: int, eps: float):
+    codes, order, counts, starts = _SHARED["layout"]
+    blk = np.array(_SHARED["X"][1][s:e], dtype=np.float64)
+    mu, sd, _, sigma2_g, gamma_hat, delta_hat, n_obs = _combat_block_moments(
+        blk, None, order, counts, starts, eps)
+    return mu, sd, gamma_hat, _guard_var(delta_hat), sigma2_g, n_obs
+
+
+def _shard_apply(s: int, e: int, mu, sd, gamma_star, delta_star):
+    codes, _, _, _ = _SHARED["layout"]
+    blk = np.array(_SHARED["X"][1][s:e], dtype=np.float64)
+    _standardize_block(blk, None)
+    _combat_block_apply(blk, codes, mu, sd, None, None, gamma_star, delta_star)
+    _SHARED["out"][1][s:e] = blk
+
+
+def combat_parallel(X: pd.DataFrame,
+                    batch: pd.Series,
+                    n_jobs: int | None = None,
+                    shard_size: int | None = None,
+                    blas_threads: int | None = None,
+                    eps: float = 1e-8,
+                    iterative: bool = False,
+                    max_iter: int = 100,
+                    tol: float = 1e-4) -> pd.DataFrame:
+    """
+    ComBat (parametric EB, no covariates) sharded over features across a process pool.
+
+    X            : features × samples
+    batch        : per-sample batch labels (index aligned to X.columns)
+    n_jobs       : worker processes (default: all CPUs); 1 runs in-process
+    shard_size   : features per task (default: ~4 tasks per worker)
+    blas_threads : BLAS/OpenMP threads per worker (default: CPUs // n_jobs, at least 1)
+    iterative, max_iter, tol : iterative EB, see combat_minimal
+
+    Returns: X_adj (same shape as X), bit-identical to combat_minimal(X, batch)
+             for any n_jobs / shard_size.
+    """
+    G, N = X.shape
+    n_jobs = n_jobs or os.cpu_count() or 1
+    blas_threads = blas_threads or max(1, (os.cpu_count() or 1) // n_jobs)
+    shard_size = shard_size or max(1, -(-G // (4 * n_jobs)))
+    shards = [(s, min(s + shard_size, G)) for s in range(0, G, shard_size)]
+
+    codes, _, order, counts, starts = _batch_segments(batch, X.columns)
+    layout = (codes, order, counts, starts)
+
+    buffers = {key: shared_memory.SharedMemory(create=True, size=max(G * N * 8, 1))
+               for key in ("X", "out")}
+    try:
+        np.ndarray((G, N), dtype=np.float64, buffer=buffers["X"].buf)[:] = X.to_numpy(dtype=np.float64)
+        specs = {key: (shm.name, (G, N)) for key, shm in buffers.items()}
+
+        pool = limits = None
+        if n_jobs == 1:
+            limits = threadpool_limits(limits=blas_threads)     # restored below
+            _attach(specs, layout)
+            run = lambda fn, argss: [fn(*args) for args in argss]
+        else:
+            pool = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                       initargs=(specs, layout, blas_threads))
+            run = lambda fn, argss: list(pool.map(fn, *zip(*argss)))
+        try:
+            # Phase 1 — per-feature moments, gathered in feature order
+            parts = run(_shard_moments, [(s, e, eps) for s, e in shards])
+            mu, sd, gamma_hat, delta_hat, sigma2_g, n_obs = (np.concatenate(p) for p in zip(*parts))
+
+            # Global EB priors across all features, and the posterior
+            gamma_star, delta_star, _, _ = _combat_eb(gamma_hat, delta_hat, n_obs, sigma2_g, eps,
+                                                      iterative=iterative, max_iter=max_iter, tol=tol)
+
+            # Phase 2 — apply the posterior shard by shard
+            run(_shard_apply, [(s, e, mu[s:e], sd[s:e], gamma_star[s:e], delta_star[s:e])
+                               for s, e in shards])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if limits is not None:
+                limits.restore_original_limits()
+            for shm, _ in (v for k, v in _SHARED.items() if k != "layout"):
+                shm.close()
+            _SHARED.clear()
+
+        X_adj = np.ndarray((G, N), dtype=np.float64, buffer=buffers["out"].buf).copy()
+    finally:
+        for shm in buffers.values():
+            shm.close()
+            shm.unlink()
+    return pd.DataFrame(X_adj, index=X.index, columns=X.columns)
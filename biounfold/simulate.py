@@ -0,0 +1,254 @@
+"""
+Synthetic features × samples data with batch effects.
+
+Importable home of the simulators used in the BioUnfold #5 notebooks
+(`bu005_alpha_batch_align`, `bu005_beta_combat`). Values are always drawn in
+float64 and cast once to `dtype`, so a float32 dataset is the float64 one
+rounded (same seed → same data up to 2**-24 relative), which is what a
+float32-vs-float64 comparison of the downstream pipeline needs.
+
+`simulate_to_disk` is the out-of-core variant for stress datasets (e.g. 1M
+samples): feature blocks are generated from SeedSequence child streams by a
+process pool and written straight into a `.npy` memmap, with labels in a
+CSV next to it.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def _wrap(X: np.ndarray, batch_labels, dtype):
+    n_features, n_total = X.shape
+    samples = [f"S{i+1}" for i in range(n_total)]
+    X_df = pd.DataFrame(X.astype(dtype, copy=False),
+                        index=[f"F{i+1}" for i in range(n_features)], columns=samples)
+    batch = pd.Series(batch_labels, index=samples, name="batch")
+    return X_df, batch
+
+
+def simulate_batch_data(
+    n_features=500,
+    n_samples_per_batch=(60, 60),
+    group=(0.5, 0.5),
+    group_shift=0.8,
+    loc_mu=0.5,
+    loc_sd=0.1,
+    scale_low=0.9,
+    scale_high=1.3,
+    dtype=np.float64,
+):
+    """
+    Simulate high-dimensional 'omics-like' data with:
+    - Two batches with distinct offsets/scales
+    - A biological grouping (0/1) with optional imbalance per batch
+
+    Draws from the global `np.random` state (seed it with np.random.seed).
+
+    Parameters
+    ----------
+    n_features : int
+        Number of features.
+    n_samples_per_batch : tuple of int
+        Number of samples per batch.
+    group : tuple of float
+        Probability of biological group=1 in each batch (must match number of batches).
+    group_shift : float
+        Mean shift applied to a subset of features for biological group=1.
+    loc_mu, loc_sd : float
+        Batch b's location shift is drawn from N(loc_mu * (b+1), loc_sd).
+    scale_low, scale_high : float
+        Batch b's multiplicative scale is drawn from U(scale_low, scale_high).
+    dtype : numpy dtype
+        dtype of X (e.g. np.float32 to halve memory).
+
+    Returns
+    -------
+    X : pd.DataFrame (features × samples)
+    batch : pd.Series (per-sample batch label)
+    group : pd.Series (per-sample biological group label)
+    """
+    batch_labels = []
+    group_labels = []
+
+    n_total = sum(n_samples_per_batch)
+    X = np.random.normal(0, 1, size=(n_features, n_total))
+
+    start = 0
+    for b, n in enumerate(n_samples_per_batch):
+        end = start + n
+        # group imbalance: proportion group=1 depends on batch
+        p = group[b] if b < len(group) else group[-1]
+        g = (np.random.rand(n) < p).astype(int)
+        group_labels.extend(g)
+
+        # batch-specific offset/scale
+        loc_shift = np.random.normal(loc_mu * (b + 1), loc_sd)
+        scale_mult = np.random.uniform(scale_low, scale_high)
+        X[:, start:end] = (X[:, start:end] + loc_shift) * scale_mult
+        batch_labels.extend([f"batch_{b+1}"] * n)
+        start = end
+
+    # biological signal
+    affected = np.random.choice(n_features, size=n_features // 5, replace=False)
+    group_labels = np.array(group_labels)
+    X[affected[:, None], np.where(group_labels == 1)[0]] += group_shift
+
+    X_df, batch = _wrap(X, batch_labels, dtype)
+    group = pd.Series(group_labels, index=X_df.columns, name="group")
+    return X_df, batch, group
+
+
+def simulate_batches_only(
+    n_features: int = 800,
+    n_samples_per_batch=(6, 10, 4, 18),   # intentionally small & unequal
+    loc_mu: float = 0.4,                     # average mean shift magnitude across batches
+    loc_sd: float = 0.05,                    # variability of mean shifts
+    scale_low: float = 0.9,                  # min multiplicative scale per batch
+    scale_high: float = 1.8,                 # max multiplicative scale per batch
+    noise_sigma: float = 1.0,
+    seed: int | None = 42,
+    dtype=np.float64,
+):
+    """
+    Simulate a features×samples matrix with batch-only effects:
+      - Base noise ~ N(0, noise_sigma)
+      - Per-batch location shift ~ N(loc_mu * (b+1), loc_sd)
+      - Per-batch multiplicative scale ~ Uniform(scale_low, scale_high)
+
+    Returns
+    -------
+    X : pd.DataFrame
+        Features × samples matrix (of `dtype`).
+    batch : pd.Series
+        Per-sample batch label aligned to X.columns.
+    """
+    rng = np.random.default_rng(seed)
+    n_total = int(np.sum(n_samples_per_batch))
+
+    # base noise
+    X = rng.normal(0.0, noise_sigma, size=(n_features, n_total))
+
+    # apply per-batch location/scale
+    start = 0
+    batch_labels = []
+    for b, n in enumerate(n_samples_per_batch):
+        end = start + n
+        loc = rng.normal(loc_mu * (b + 1), loc_sd)      # increasing mean by batch index
+        sca = rng.uniform(scale_low, scale_high)        # heteroscedastic scales
+        X[:, start:end] = (X[:, start:end] + loc) * sca
+        batch_labels.extend([f"batch_{b+1}"] * n)
+        start = end
+
+    return _wrap(X, batch_labels, dtype)
+
+
+# Per-process view of the output memmap and per-sample effects (set by _init_worker)
+_SIM = {}
+
+
+def _init_worker(path, columns):
+    _SIM.clear()
+    _SIM["X"] = np.load(path, mmap_mode="r+")
+    _SIM.update(columns)
+
+
+def _simulate_rows(s: int, e: int, seeds, noise_sigma: float):
+    """Rows s..e of the output, row f drawn from its own child stream seeds[f - s]."""
+    X, n = _SIM["X"], _SIM["X"].shape[1]
+    block = np.empty((e - s, n))
+    for r, ss in enumerate(seeds):
+        block[r] = np.random.default_rng(ss).normal(0.0, noise_sigma, size=n)
+    block += _SIM["loc"]
+    block *= _SIM["scale"]
+    affected = _SIM["affected"][s:e]
+    if affected.any():
+        block[affected] += _SIM["shift"]
+    X[s:e] = block
+    X.flush()
+
+
+def simulate_to_disk(
+    out,
+    n_features: int = 500,
+    n_samples_per_batch=(60, 60),
+    group=(0.5, 0.5),
+    group_shift: float = 0.8,
+    loc_mu: float = 0.5,
+    loc_sd: float = 0.1,
+    scale_low: float = 0.9,
+    scale_high: float = 1.3,
+    noise_sigma: float = 1.0,
+    seed: int = 0,
+    dtype=np.float64,
+    chunk_size: int | None = None,
+    n_jobs: int | None = None,
+):
+    """
+    Simulate a large features × samples matrix straight into a `.npy` file,
+    feature blocks in parallel.
+
+    The model is that of simulate_batch_data / simulate_batches_only, with
+    their parameters: per-batch location N(loc_mu·(b+1), loc_sd) and scale
+    U(scale_low, scale_high) on N(0, noise_sigma) noise, and `group_shift`
+    added to a fifth of the features for group=1 samples (group[b] =
+    P(group=1) in batch b; group=None simulates batch effects only).
+
+    Randomness comes from SeedSequence(seed).spawn: one child stream for the
+    labels and batch parameters, and one per feature row. The output depends
+    only on `seed` and the model parameters — not on chunk_size or n_jobs.
+
+    out        : output `.npy` path (written as a `dtype` memmap); labels go
+                 to `<out stem>.labels.csv` (columns batch[, group], in
+                 column order)
+    chunk_size : feature rows per task (default: ~32 MB of float64 per task)
+    n_jobs     : worker processes (default: all CPUs); 1 runs in-process
+
+    Returns: (X, labels) — X reopened read-only as a memmap, labels a DataFrame.
+    """
+    out = Path(out)
+    n_samples_per_batch = tuple(int(n) for n in n_samples_per_batch)
+    n_total = sum(n_samples_per_batch)
+    B = len(n_samples_per_batch)
+    root = np.random.SeedSequence(seed)
+    label_seed, *row_seeds = root.spawn(n_features + 1)
+
+    # labels, batch parameters and affected features — one stream, drawn in batch order
+    rng = np.random.default_rng(label_seed)
+    codes = np.repeat(np.arange(B), n_samples_per_batch)
+    loc = rng.normal(loc_mu * (np.arange(B) + 1), loc_sd)
+    scale = rng.uniform(scale_low, scale_high, size=B)
+    labels = pd.DataFrame({"batch": np.array([f"batch_{b+1}" for b in range(B)])[codes]})
+    affected = np.zeros(n_features, dtype=bool)
+    shift = np.zeros(n_total)
+    if group is not None:
+        p = np.array([group[b] if b < len(group) else group[-1] for b in range(B)])
+        g = (rng.random(n_total) < p[codes]).astype(int)
+        affected[rng.choice(n_features, size=n_features // 5, replace=False)] = True
+        shift = group_shift * g
+        labels["group"] = g
+
+    X = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=(n_features, n_total))
+    del X                                               # created; workers reopen it
+    columns = {"loc": loc[codes], "scale": scale[codes], "shift": shift, "affected": affected}
+
+    chunk = chunk_size or max(1, (1 << 22) // max(n_total, 1))
+    tasks = [(s, min(s + chunk, n_features)) for s in range(0, n_features, chunk)]
+    args = [(s, e, row_seeds[s:e], noise_sigma) for s, e in tasks]
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        _init_worker(out, columns)
+        try:
+            for a in args:
+                _simulate_rows(*a)
+        finally:
+            _SIM.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(out, columns)) as pool:
+            list(pool.map(_simulate_rows, *zip(*args)))
+
+    labels.to_csv(out.with_suffix(".labels.csv"), index=False)
+    return np.load(out, mmap_mode="r"), labels
@@ -0,0 +1,136 @@
+"""
+Out-of-core ComBat over memory-mapped features × samples matrices.
+
+`combat_minimal` holds the whole matrix plus several full-size copies in RAM.
+`combat_streaming` reads feature blocks from a `.npy` file (or any array /
+np.memmap) and never holds more than one block at a time:
+
+  pass 1 — per block: standardize, per-batch residual moments; merge their
+           across-feature mean/variance into the EB hyperparameters
+           (gamma0, tau2, a, b).
+  pass 2 — per block: recompute the block's moments, apply the EB posterior,
+           write the corrected block to an output memmap.
+
+Each feature is standardized across all samples, so blocks are independent
+apart from the hyperparameters. The result matches `combat_minimal` up to
+floating-point summation order. Input must be finite; for missing values
+use combat_minimal.
+"""
+import numpy as np
+import pandas as pd
+
+from .correction import _batch_segments, _segment_center, _guard_var, _eb_priors, _eb_posterior
+
+
+def _open_input(src):
+    """np.ndarray / np.memmap as-is; a path is opened read-only as a memmap."""
+    if isinstance(src, np.ndarray):
+        return src
+    return np.load(src, mmap_mode="r")
+
+
+def _merge_moments(acc, est: np.ndarray):
+    """
+    Fold the column moments of `est` (rows × batches) into a running
+    (count, mean, M2) accumulator — Chan et al. pairwise update.
+    """
+    n_a, mean_a, m2_a = acc
+    n_b = est.shape[0]
+    mean_b = est.mean(axis=0)
+    m2_b = np.square(est - mean_b).sum(axis=0)
+    n = n_a + n_b
+    d = mean_b - mean_a
+    mean = mean_a + d * (n_b / n)
+    m2 = m2_a + m2_b + d**2 * (n_a * n_b / n)
+    return n, mean, m2
+
+
+def _block_moments(block: np.ndarray, order, counts, starts, eps: float):
+    """
+    Standardize one feature block and estimate its per-batch residual moments.
+    Returns: mu, sd, Rs (standardized, batch-sorted, centered per batch),
+             gamma_hat, delta_hat, sigma2_g.
+    """
+    mu = block.mean(axis=1)
+    sd = _guard_var(block.std(axis=1, ddof=1))
+    Rs = block[:, order]
+    Rs -= mu[:, None]
+    Rs /= sd[:, None]
+    sigma2_g = Rs.var(axis=1, ddof=1) + eps
+    gamma_hat, delta_hat = _segment_center(Rs, counts, starts)
+    _guard_var(delta_hat)
+    return mu, sd, Rs, gamma_hat, delta_hat, sigma2_g
+
+
+def combat_streaming(src,
+                     batch,
+                     out,
+                     chunk_size: int = 1024,
+                     eps: float = 1e-8,
+                     iterative: bool = False,
+                     max_iter: int = 100,
+                     tol: float = 1e-4,
+                     dtype=np.float64):
+    """
+    Two-pass, block-wise ComBat (parametric EB, no covariates).
+
+    src        : features × samples `.npy` path, np.memmap or ndarray
+    batch      : per-sample batch labels (array-like, length = n_samples)
+    out        : output `.npy` path (created as a `dtype` memmap) or a writable
+                 array of the same shape
+    chunk_size : features per block. Peak working memory is about
+                 4 × chunk_size × n_samples × 8 bytes, independent of n_features.
+    iterative, max_iter, tol : iterative EB, see combat_minimal
+    dtype      : dtype of a created output memmap (np.float32 halves the disk
+                 footprint). Blocks are computed in float64 whatever the input
+                 and output dtypes, so a float32 output is within
+                 2**-24·|X_adj| of the float64 one.
+
+    Returns: (X_adj, priors) — the output memmap/array and a dict with the
+             per-batch hyperparameters gamma0, tau2, a, b and EB iterations n_iter.
+    """
+    X = _open_input(src)
+    G, N = X.shape
+    if isinstance(out, np.ndarray):
+        X_adj = out
+    else:
+        X_adj = np.lib.format.open_memmap(out, mode="w+", dtype=dtype, shape=(G, N))
+
+    _, levels, order, counts, starts = _batch_segments(pd.Series(np.asarray(batch)), pd.RangeIndex(N))
+    B = len(levels)
+
+    # Pass 1 — across-feature moments of gamma_hat / delta_hat, merged block by block
+    zeros = np.zeros(B)
+    gamma_acc = (0, zeros, zeros)
+    delta_acc = (0, zeros, zeros)
+    for s in range(0, G, chunk_size):
+        block = np.array(X[s:s + chunk_size], dtype=np.float64)
+        _, _, _, gamma_hat, delta_hat, _ = _block_moments(block, order, counts, starts, eps)
+        gamma_acc = _merge_moments(gamma_acc, gamma_hat)
+        delta_acc = _merge_moments(delta_acc, delta_hat)
+
+    ddof_n = max(G - 1, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        priors = _eb_priors(gamma_acc[1], gamma_acc[2] / ddof_n,
+                            delta_acc[1], delta_acc[2] / ddof_n)
+
+    # Pass 2 — EB posterior per block, written straight to the output
+    n_iter = np.zeros(B, dtype=int)
+    for s in range(0, G, chunk_size):
+        block = np.array(X[s:s + chunk_size], dtype=np.float64)
+        mu, sd, Rs, gamma_hat, delta_hat, sigma2_g = _block_moments(block, order, counts, starts, eps)
+        gamma_star, delta_star, it = _eb_posterior(gamma_hat, delta_hat, counts, sigma2_g, priors, eps,
+                                                   iterative=iterative, max_iter=max_iter, tol=tol)
+        n_iter = np.maximum(n_iter, it)
+        # Rs holds R - gamma_hat; shift to R - gamma_star and rescale
+        Rs += np.repeat(gamma_hat - gamma_star, counts, axis=1)
+        Rs /= np.repeat(np.sqrt(delta_star), counts, axis=1)
+        Rs *= sd[:, None]
+        Rs += mu[:, None]
+        block[:, order] = Rs
+        X_adj[s:s + chunk_size] = block
+
+    if isinstance(X_adj, np.memmap):
+        X_adj.flush()
+    gamma0, tau2, a, b = priors
+    return X_adj, {"levels": levels, "gamma0": gamma0, "tau2": tau2, "a": a, "b": b, "n_iter": n_iter}
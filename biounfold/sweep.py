@@ -0,0 +1,199 @@
+"""
+Parameter sweeps over simulate → correct → evaluate.
+
+`run_sweep` expands a grid of simulation and correction parameters (every
+combination of the listed values), runs each cell on a process pool and
+appends every finished cell to a CSV results table as soon as it completes.
+Cells are identified by a hash of their parameters; re-running the same
+sweep skips the cells already in the table, so an interrupted sweep resumes
+where it stopped and a grown grid only runs its new cells. A row cut short
+by a crash does not count as done: its cell runs again. If a cell raises,
+the cells already finished are checkpointed before the error propagates.
+
+    grid = {"n_samples_per_batch": [(6, 10, 4, 18), (30, 30, 30, 30)],
+            "group": [(0.5, 0.5), (0.2, 0.8)],
+            "method": ["none", "align", "combat"],
+            "seed": range(5)}
+    results = run_sweep(grid, "sweeps/bu005.csv")
+
+Each cell simulates with simulate_batch_data (batch shift magnitude from
+`loc_mu`/`loc_sd`/`scale_low`/`scale_high`, global RNG seeded with the
+cell's `seed`), corrects with batch_align_minimal / combat_minimal (with an
+Intercept + Group design if `design`), and reports the z-scored NN
+consistency for batch and biology from one kNN graph.
+"""
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .correction import batch_align_minimal, combat_minimal
+from .metrics import nn_summary_table
+from .simulate import simulate_batch_data
+
+# Cell parameters and their defaults; simulation keys go to simulate_batch_data
+DEFAULTS = {
+    "n_features": 500,
+    "n_samples_per_batch": (60, 60),
+    "group": (0.5, 0.5),
+    "group_shift": 0.8,
+    "loc_mu": 0.5,
+    "loc_sd": 0.1,
+    "scale_low": 0.9,
+    "scale_high": 1.3,
+    "method": "combat",
+    "design": False,
+    "k": 5,
+    "seed": 0,
+}
+_SIM_KEYS = ("n_features", "n_samples_per_batch", "group", "group_shift",
+             "loc_mu", "loc_sd", "scale_low", "scale_high")
+_METHODS = {"none": None, "align": batch_align_minimal, "combat": combat_minimal}
+
+
+def expand_grid(grid: dict, base: dict | None = None) -> list:
+    """Every combination of the grid values, on top of DEFAULTS (and `base`)."""
+    unknown = set(grid) | set(base or {})
+    unknown -= set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"unknown sweep parameters: {sorted(unknown)}")
+    keys = list(grid)
+    cells = []
+    for values in itertools.product(*(list(grid[k]) for k in keys)):
+        cell = {**DEFAULTS, **(base or {}), **dict(zip(keys, values))}
+        if cell["method"] not in _METHODS:
+            raise ValueError(f"unknown method {cell['method']!r}; expected one of {list(_METHODS)}")
+        cells.append(cell)
+    return cells
+
+
+def cell_id(cell: dict) -> str:
+    """Stable id of a cell: hash of its parameters (tuples and lists alike)."""
+    blob = json.dumps(cell, sort_keys=True,
+                      default=lambda v: v.tolist() if hasattr(v, "tolist") else list(v))
+    return hashlib.blake2b(blob.encode(), digest_size=8).hexdigest()
+
+
+def run_cell(cell: dict) -> dict:
+    """Simulate, correct and evaluate one cell. Returns its results row."""
+    t0 = time.perf_counter()
+    np.random.seed(cell["seed"])
+    X, batch, group = simulate_batch_data(**{k: cell[k] for k in _SIM_KEYS})
+    design = None
+    if cell["design"]:
+        design = pd.DataFrame({"Intercept": 1.0, "Group": group.values}, index=group.index)
+
+    correct = _METHODS[cell["method"]]
+    X_adj = X if correct is None else correct(X, batch, design=design)
+    scores = nn_summary_table([(cell["method"], X_adj)], batch, group, k=cell["k"]).iloc[0]
+
+    row = {"cell_id": cell_id(cell)}
+    row.update({k: str(v) if isinstance(v, (tuple, list)) else v for k, v in cell.items()})
+    row.update(scores.to_dict())
+    row["seconds"] = round(time.perf_counter() - t0, 3)
+    return row
+
+
+def _append_row(path: Path, row: dict):
+    """Append one results row to the CSV checkpoint (header on first write): one write, synced."""
+    new = not path.exists() or path.stat().st_size == 0
+    line = pd.DataFrame([row]).to_csv(index=False, header=new)
+    with open(path, "a") as fh:
+        fh.write(line)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def _drop_partial_tail(path: Path):
+    """Cut a row left unfinished by a crash (no final newline) off the checkpoint."""
+    data = path.read_bytes()
+    if data and not data.endswith(b"\n"):
+        with open(path, "r+b") as fh:
+            fh.truncate(data.rfind(b"\n") + 1)
+
+
+def _is_number(field: str) -> bool:
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return field.strip().lower() != "nan"
+
+
+def _read_checkpoint(path: Path) -> pd.DataFrame:
+    """
+    Complete rows of the checkpoint: as many fields as the header and every
+    score column (NN consistencies, seconds) a number. Anything else — e.g. a
+    row cut mid-write — is left out, so its cell counts as not done. A file
+    without a complete header row has no done cells.
+    """
+    with open(path, newline="") as fh:
+        header, *rows = list(csv.reader(fh)) or [None]
+    if not header:
+        return pd.DataFrame({"cell_id": pd.Series(dtype=str)})
+    scores = [i for i, col in enumerate(header) if col.endswith(" NN (z)") or col == "seconds"]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    writer.writerows(r for r in rows
+                     if len(r) == len(header) and all(_is_number(r[i]) for i in scores))
+    buf.seek(0)
+    return pd.read_csv(buf, dtype={"cell_id": str})
+
+
+def run_sweep(grid: dict, checkpoint, base: dict | None = None,
+              n_jobs: int | None = None) -> pd.DataFrame:
+    """
+    Run every cell of `grid` not yet in the `checkpoint` CSV, in parallel.
+
+    grid       : parameter → list of values (keys from DEFAULTS)
+    checkpoint : results CSV; finished cells are appended one row at a time
+    base       : fixed overrides of DEFAULTS for all cells
+    n_jobs     : worker processes (default: all CPUs); 1 runs in-process
+
+    Returns: results of all grid cells (including earlier runs), in grid order.
+    """
+    path = Path(checkpoint)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cells = expand_grid(grid, base)
+    ids = [cell_id(c) for c in cells]
+
+    done = set()
+    if path.exists() and path.stat().st_size > 0:
+        _drop_partial_tail(path)
+    if path.exists() and path.stat().st_size > 0:
+        done = set(_read_checkpoint(path)["cell_id"])
+    todo = [c for c, i in zip(cells, ids) if i not in done]
+    todo = list({cell_id(c): c for c in todo}.values())     # duplicate grid values run once
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        for cell in todo:
+            _append_row(path, run_cell(cell))
+    elif todo:
+        error = None
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(run_cell, c) for c in todo]
+            for fut in as_completed(futures):
+                if fut.cancelled():
+                    continue
+                if fut.exception() is None:
+                    _append_row(path, fut.result())        # checkpoint as each cell finishes
+                elif error is None:
+                    error = fut.exception()                # stop queued cells; running ones
+                    for f in futures:                      # still finish and are checkpointed
+                        f.cancel()
+        if error is not None:
+            raise error
+
+    results = _read_checkpoint(path)
+    results = results.drop_duplicates("cell_id", keep="last").set_index("cell_id")
+    return results.loc[[i for i in dict.fromkeys(ids)]].reset_index()
@@ -0,0 +1,97 @@
+"""Regression tests for biounfold.correction."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from biounfold.correction import batch_align_minimal, combat_minimal
+
+
+def _dropout_counts():
+    """Sparse Poisson counts, 3 batches of 40, plus one all-zero batch per feature 0–9."""
+    rng = np.random.default_rng(0)
+    X = rng.poisson(0.1, (300, 120)).astype(float)
+    X[:10, 40:80] = 0.0
+    cols = [f"S{i}" for i in range(120)]
+    batch = pd.Series(np.repeat(["a", "b", "c"], 40), index=cols)
+    return pd.DataFrame(X, columns=cols), batch
+
+
+def _constant_cells(X, batch):
+    codes = pd.factorize(batch.to_numpy())[0]
+    flat = np.stack([np.ptp(X[:, codes == k], axis=1) == 0 for k in range(codes.max() + 1)], 1)
+    return flat[:, codes]
+
+
+@pytest.mark.parametrize("robust", [None, "median", "trimmed"])
+def test_align_constant_batch_maps_to_feature_mean(robust):
+    X, batch = _dropout_counts()
+    Xv = X.to_numpy()
+    out = batch_align_minimal(X, batch, robust=robust).to_numpy()
+    const = _constant_cells(Xv, batch)
+    assert const[:10, 40:80].all()
+    mu = np.broadcast_to(Xv.mean(axis=1)[:, None], Xv.shape)
+    assert np.array_equal(out[const], mu[const])
+
+
+def test_align_constant_batch_with_nans():
+    X, batch = _dropout_counts()
+    X.iloc[0, 0] = np.nan
+    out = batch_align_minimal(X, batch).to_numpy()
+    assert np.isnan(out[0, 0])
+    assert np.ptp(out[:10, 40:80], axis=1).max() == 0
+    assert np.allclose(out[1:10, 40:80], X.to_numpy()[1:10].mean(axis=1)[:, None])
+
+
+def test_combat_constant_batch_with_nans_matches_sparse():
+    import scipy.sparse as sp
+    X, batch = _dropout_counts()
+    Xv = X.to_numpy()
+    Xv[0, 0] = Xv[5, 50] = np.nan
+    dense = combat_minimal(Xv, batch.to_numpy())
+    sparse = combat_minimal(sp.csr_matrix(Xv), batch.to_numpy())
+    assert np.array_equal(np.isnan(dense), np.isnan(sparse))
+    assert np.nanmax(np.abs(dense - sparse)) < 1e-12
+    assert np.nanmax(np.ptp(dense[:10, 40:80], axis=1)) == 0
+
+
+def test_combat_constant_batch_dense_matches_sparse():
+    import scipy.sparse as sp
+    X, batch = _dropout_counts()
+    dense = combat_minimal(X, batch).to_numpy()
+    sparse = combat_minimal(sp.csr_matrix(X.to_numpy()), batch.to_numpy())
+    assert np.abs(dense - sparse).max() < 1e-12
+    assert np.ptp(dense[:10, 40:80], axis=1).max() == 0
+
+
+@pytest.mark.parametrize("fn", [batch_align_minimal, combat_minimal])
+def test_sparse_path_honours_out_dtype_chunk_size(fn):
+    import scipy.sparse as sp
+    X, batch = _dropout_counts()
+    S, b = sp.csr_matrix(X.to_numpy()), batch.to_numpy()
+    ref = fn(S, b)
+    out = np.empty(X.shape)
+    assert fn(S, b, out=out, chunk_size=7) is out
+    assert np.abs(out - ref).max() == 0
+    assert fn(S, b, dtype=np.float32).dtype == np.float32
+    with pytest.raises(ValueError):
+        fn(S, b, output="factors", out=out)
+    with pytest.raises(ValueError):
+        fn(X, batch, output="lowrank", chunk_size=7)
+
+
+@pytest.mark.parametrize("fn", [batch_align_minimal, combat_minimal])
+def test_factors_keep_precision_under_large_offset(fn):
+    import scipy.sparse as sp
+    rng = np.random.default_rng(1)
+    X = rng.normal(0, 1, (200, 90)) + 1e6
+    b = np.repeat(["a", "b", "c"], 30)
+    dense = fn(X, b)
+    assert np.abs(fn(X, b, output="factors").apply(X) - dense).max() < 1e-8
+    assert np.abs(fn(sp.csr_matrix(X), b) - dense).max() < 1e-8
+
+
+def test_combat_lowrank_rejects_eb_options():
+    X, batch = _dropout_counts()
+    with pytest.raises(ValueError, match="parametric"):
+        combat_minimal(X, batch, output="lowrank", rank=5, parametric=False)
+    combat_minimal(X, batch, output="lowrank", rank=5)